@@ -1,21 +1,44 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
 from motor.motor_asyncio import AsyncIOMotorClient
 import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timedelta
+import weakref
+from datetime import datetime, timedelta, timezone
 import bcrypt
 from jose import JWTError, jwt
+from urllib.parse import parse_qs, urlparse
+import msgpack
+import orjson
+from pymongo import InsertOne, UpdateOne, IndexModel, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import hashlib
+import httpx
 import json
+import math
+import multiprocessing
 import random
+import secrets
+import socket
+import threading
+import time
 from enum import Enum
+from bisect import bisect_left, insort
+from functools import lru_cache, wraps
+from itertools import combinations
+import numpy as np
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -30,7 +53,235 @@ if not db_name:
     parsed_url = urllib.parse.urlparse(mongo_url)
     db_name = parsed_url.path.lstrip('/') or 'chinchon_game'
 
-client = AsyncIOMotorClient(mongo_url)
+# Queries slower than this many milliseconds are logged with an index check
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+
+# Run settlement inside a MongoDB transaction (needs a replica set, e.g. Atlas)
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'false').lower() == 'true'
+# Recent matches remembered on each user as settled, so a retried settlement skips them
+SETTLED_MATCHES_KEPT = int(os.environ.get('SETTLED_MATCHES_KEPT', '100'))
+
+# Lobby listings: fields sent for each match and the largest page size
+LOBBY_FIELDS = ["id", "host_id", "target_points", "stake_amount", "status", "players", "created_at"]
+LOBBY_PAGE_SIZE = 100
+
+# Matchmaking: stakes are matched on levels that are multiples of this step,
+# and one request may cover at most this many levels
+MATCHMAKING_STAKE_STEP = float(os.environ.get('MATCHMAKING_STAKE_STEP', '10'))
+MATCHMAKING_MAX_LEVELS = int(os.environ.get('MATCHMAKING_MAX_LEVELS', '20'))
+# Seconds a queued ticket stays valid; polling GET /api/matchmaking renews it
+MATCHMAKING_TICKET_TTL = float(os.environ.get('MATCHMAKING_TICKET_TTL', '120'))
+
+# Chat: messages kept in memory per match, and how long MongoDB keeps them
+CHAT_HISTORY_SIZE = int(os.environ.get('CHAT_HISTORY_SIZE', '50'))
+CHAT_TTL_SECONDS = int(os.environ.get('CHAT_TTL_SECONDS', str(7 * 24 * 3600)))
+# Matches whose chat stays buffered, and for how long after the last message
+CHAT_BUFFER_COUNT = int(os.environ.get('CHAT_BUFFER_COUNT', '10000'))
+CHAT_BUFFER_TTL = float(os.environ.get('CHAT_BUFFER_TTL', '3600'))
+
+# Indexes for every hot query path, ensured at startup
+COLLECTION_INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+    "matches": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "chat_messages": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("match_id", ASCENDING), ("created_at", ASCENDING)], name="match_id_created_at"),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=CHAT_TTL_SECONDS, name="created_at_ttl"),
+    ],
+    "match_events": [
+        IndexModel([("match_id", ASCENDING), ("seq", ASCENDING)], unique=True, name="match_id_seq_unique"),
+    ],
+    "match_snapshots": [
+        IndexModel([("match_id", ASCENDING), ("seq", ASCENDING)], unique=True, name="match_id_seq_unique"),
+    ],
+    "match_rounds": [
+        IndexModel([("match_id", ASCENDING), ("round", ASCENDING)], unique=True, name="match_id_round_unique"),
+    ],
+    "transactions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at"),
+        IndexModel([("match_id", ASCENDING)], name="match_id"),
+    ],
+}
+
+# Metrics, exposed in the Prometheus text format by /api/metrics
+# Latency histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Seconds between event loop lag probes
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '0.5'))
+
+def metric_labels(names, values):
+    """Prometheus label set, e.g. {event="game_action"}"""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Latency histogram with one series per label values; safe to observe from pymongo's threads"""
+    def __init__(self, name, description, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count
+                series = self.series[label_values] = [0] * (len(self.buckets) + 3)
+            series[bisect_left(self.buckets, seconds)] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((values, list(counts)) for values, counts in self.series.items())
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for values, counts in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = metric_labels(self.label_names + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = metric_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {counts[-2]}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+def render_metric(name, description, metric_type, samples):
+    """A counter or gauge from (label dict, value) samples"""
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{metric_labels(labels.keys(), labels.values())} {value}")
+    return lines
+
+socket_event_latency = Histogram(
+    "socketio_event_duration_seconds", "Socket.IO event handler latency", ("event",))
+http_request_latency = Histogram(
+    "http_request_duration_seconds", "REST request latency by route", ("method", "route", "status"))
+mongo_command_latency = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection", ("collection", "command", "outcome"))
+# Most recent and largest event loop lag seen by the probe, in seconds
+loop_lag = {"last": 0.0, "max": 0.0}
+
+def timed_event(handler):
+    """Record a Socket.IO handler's latency under its event name"""
+    @wraps(handler)
+    async def timed(sid, *args):
+        started = time.perf_counter()
+        try:
+            return await handler(sid, *args)
+        finally:
+            socket_event_latency.observe(time.perf_counter() - started, handler.__name__)
+    return timed
+
+async def loop_lag_probe():
+    """Measure how late the event loop wakes a sleeping task"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(time.perf_counter() - started - LOOP_LAG_INTERVAL, 0.0)
+        loop_lag["last"] = lag
+        loop_lag["max"] = max(loop_lag["max"], lag)
+
+# Recent slow queries, reported by /api/admin/indexes
+slow_queries = deque(maxlen=100)
+
+def query_fields(query):
+    """Field names a MongoDB filter document tests, including inside $and/$or"""
+    fields = set()
+    for key, value in (query or {}).items():
+        if key in ("$and", "$or", "$nor"):
+            for clause in value:
+                fields |= query_fields(clause)
+        elif not key.startswith("$"):
+            fields.add(key)
+    return fields
+
+def is_indexed(collection, fields):
+    """Whether a declared index can serve a filter on these fields (prefix match)"""
+    return any(
+        next(iter(index.document["key"])) in fields
+        for index in COLLECTION_INDEXES.get(collection, [])
+    )
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Log commands slower than SLOW_QUERY_MS and warn when no index covers their filter"""
+    FILTERS = {
+        "find": lambda command: command.get("filter"),
+        "aggregate": lambda command: next(
+            (stage["$match"] for stage in command.get("pipeline", []) if "$match" in stage), None),
+        "update": lambda command: (command.get("updates") or [{}])[0].get("q"),
+        "delete": lambda command: (command.get("deletes") or [{}])[0].get("q"),
+        "findAndModify": lambda command: command.get("query"),
+    }
+
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        get_filter = self.FILTERS.get(event.command_name)
+        if get_filter:
+            collection = event.command.get(event.command_name)
+            self.pending[(event.connection_id, event.request_id)] = (collection, query_fields(get_filter(event.command)))
+
+    def succeeded(self, event):
+        query = self.pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if query is None or duration_ms < SLOW_QUERY_MS:
+            return
+        collection, fields = query
+        indexed = not fields or is_indexed(collection, fields)
+        slow_queries.append({
+            "collection": collection,
+            "command": event.command_name,
+            "fields": sorted(fields),
+            "duration_ms": round(duration_ms, 1),
+            "indexed": indexed,
+            "at": datetime.utcnow()
+        })
+        if indexed:
+            logger.warning("Slow %s on %s (%.1f ms)", event.command_name, collection, duration_ms)
+        else:
+            logger.warning("Slow %s on %s (%.1f ms): no declared index covers %s",
+                           event.command_name, collection, duration_ms, sorted(fields))
+
+    def failed(self, event):
+        self.pending.pop((event.connection_id, event.request_id), None)
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Time every MongoDB command into mongodb_command_duration_seconds"""
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self.pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        self.record(event, "success")
+
+    def failed(self, event):
+        self.record(event, "failure")
+
+    def record(self, event, outcome):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_latency.observe(event.duration_micros / 1e6, collection, event.command_name, outcome)
+
+client = AsyncIOMotorClient(mongo_url, event_listeners=[SlowQueryListener(), CommandMetricsListener()])
 db = client[db_name]
 
 # JWT Configuration
@@ -38,12 +289,271 @@ SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# bcrypt runs on a bounded thread pool; requests beyond the queue limit are rejected
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', '64'))
+
+# Authenticated users and decoded tokens are cached for this many seconds
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30'))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+
+# Write-behind persistence: seconds between flushes of in-memory game changes
+GAME_FLUSH_INTERVAL = float(os.environ.get('GAME_FLUSH_INTERVAL', '2.0'))
+
+# Match actions go to an append-only event log; the full game state is only
+# written as a snapshot every this many events and when a match ends
+MATCH_SNAPSHOT_INTERVAL = int(os.environ.get('MATCH_SNAPSHOT_INTERVAL', '20'))
+
+# Turn clock: seconds a player has for each turn (0 disables it) before the
+# server plays it for them, and consecutive timed-out turns that forfeit the match
+TURN_TIMEOUT_SECONDS = float(os.environ.get('TURN_TIMEOUT_SECONDS', '60'))
+TURN_TIMEOUT_FORFEIT = int(os.environ.get('TURN_TIMEOUT_FORFEIT', '3'))
+
+# Turn deadlines sit on a timer wheel with this many slots, advanced every tick seconds
+TURN_TIMER_TICK = float(os.environ.get('TURN_TIMER_TICK', '1.0'))
+TURN_TIMER_SLOTS = int(os.environ.get('TURN_TIMER_SLOTS', '512'))
+
+# Bot opponents: accounts kept for bots, the house money they are topped up to,
+# and seconds a match waits in the lobby before a bot takes the empty seat
+# (tables only wait that long off-peak; 0 disables filling)
+BOT_COUNT = int(os.environ.get('BOT_COUNT', '4'))
+BOT_BALANCE = float(os.environ.get('BOT_BALANCE', '10000'))
+BOT_FILL_AFTER_SECONDS = float(os.environ.get('BOT_FILL_AFTER_SECONDS', '90'))
+
+# Bot moves are searched in a pool of this many processes, for this many seconds
+# each, with rollouts this many draws deep; a search not back within the grace
+# is replaced by a greedy move
+BOT_PROCESSES = int(os.environ.get('BOT_PROCESSES', '2'))
+BOT_MOVE_BUDGET = float(os.environ.get('BOT_MOVE_BUDGET', '0.5'))
+BOT_MOVE_GRACE = float(os.environ.get('BOT_MOVE_GRACE', '2.0'))
+BOT_ROLLOUT_DEPTH = int(os.environ.get('BOT_ROLLOUT_DEPTH', '2'))
+
+# Websocket/polling compression of Socket.IO payloads above a size threshold
+SOCKETIO_COMPRESSION = os.environ.get('SOCKETIO_COMPRESSION', 'true').lower() == 'true'
+SOCKETIO_COMPRESSION_THRESHOLD = int(os.environ.get('SOCKETIO_COMPRESSION_THRESHOLD', '1024'))
+
+# Horizontal scaling: this worker's index, the number of workers and their
+# internal base URLs (comma separated, in worker order). Each match is owned by
+# the worker that consistent hashing of its id points to.
+WORKER_ID = int(os.environ.get('WORKER_ID', '0'))
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', '1'))
+WORKER_URLS = [url.rstrip('/') for url in os.environ.get('WORKER_URLS', '').split(',') if url]
+
+# Socket.IO message queue shared by the workers: a redis:// URL (needs the redis
+# package), a tcp://host:port message hub, "local" for the in-process stand-in,
+# or empty for a single worker
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+# Port of the message hub --workers starts when no redis:// queue is set (0 picks a free one)
+MESSAGE_HUB_PORT = int(os.environ.get('MESSAGE_HUB_PORT', '0'))
+# Largest message, in bytes, the hub and its clients accept
+MESSAGE_HUB_LINE_LIMIT = int(os.environ.get('MESSAGE_HUB_LINE_LIMIT', str(16 * 1024 * 1024)))
+
+# Reconnects: deltas kept per match so a client resuming from its last seq gets
+# only what it missed; a longer gap gets a full match_state instead
+MATCH_DELTA_BUFFER_SIZE = int(os.environ.get('MATCH_DELTA_BUFFER_SIZE', '64'))
+
+# Number of hands whose optimal melds are memoized
+MELD_CACHE_SIZE = int(os.environ.get('MELD_CACHE_SIZE', '65536'))
+
+# Serialization
+def json_default(value):
+    """Encode values that orjson and msgpack do not support natively"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Type is not serializable: {type(value).__name__}")
+
+class OrjsonCodec:
+    """Stand-in for the json module used by python-socketio, backed by orjson"""
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj, default=json_default).decode('utf-8')
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return orjson.loads(data)
+
+class FastJSONResponse(Response):
+    """JSON response for trusted MongoDB documents, skipping Pydantic re-validation"""
+    media_type = "application/json"
+
+    def render(self, content):
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+def pack_payload(data):
+    """Encode an event payload for sockets in msgpack binary mode"""
+    return msgpack.packb(data, default=json_default)
+
+# Workers
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring mapping keys to worker ids through virtual nodes"""
+    def __init__(self, workers, replicas=128):
+        self.points = sorted(
+            (ring_hash(f"worker-{worker}:{replica}"), worker)
+            for worker in workers for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in self.points]
+
+    def owner(self, key):
+        index = bisect_left(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.points[index][1]
+
+worker_ring = HashRing(range(WORKER_COUNT))
+
+def key_owner(key):
+    """Worker that owns a match id or another sharded key"""
+    return WORKER_ID if WORKER_COUNT == 1 else worker_ring.owner(key)
+
+class LocalPubSubManager(AsyncPubSubManager):
+    """In-process stand-in for a message queue.
+    
+    Every manager created on the same channel in this process receives every
+    message, serialized as it would be on the wire, so several servers can be
+    run and tested together without Redis.
+    """
+    name = 'local'
+    channels = {}
+
+    def __init__(self, channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.queue = asyncio.Queue()
+        self.channels.setdefault(channel, []).append(self.queue)
+
+    async def _publish(self, data):
+        message = self.json.dumps(data)
+        for queue in self.channels[self.channel]:
+            queue.put_nowait(message)
+
+    async def _listen(self):
+        while True:
+            yield await self.queue.get()
+
+class TcpPubSubManager(AsyncPubSubManager):
+    """Message queue client of a hub started by serve_message_hub.
+    
+    The url is tcp://host:port. Messages travel as JSON lines on one
+    connection per worker, which the hub relays to every connected worker,
+    so worker processes on one host can share a queue without Redis.
+    """
+    name = 'tcp'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        parsed_url = urlparse(url)
+        self.address = (parsed_url.hostname, parsed_url.port)
+        self.connect_lock = asyncio.Lock()
+        self.reader = self.writer = None
+
+    async def _connect(self):
+        async with self.connect_lock:
+            if self.writer is None or self.writer.is_closing():
+                self.reader, self.writer = await asyncio.open_connection(
+                    *self.address, limit=MESSAGE_HUB_LINE_LIMIT)
+            return self.reader, self.writer
+
+    async def _publish(self, data):
+        message = self.json.dumps(data)
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        _, writer = await self._connect()
+        writer.write(message + b'\n')
+        await writer.drain()
+
+    async def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                reader, _ = await self._connect()
+                async for line in reader:
+                    retry_sleep = 1
+                    yield line
+                raise ConnectionResetError("Message hub closed the connection")
+            except (OSError, ValueError) as e:
+                logger.error("Message hub %s:%s unavailable (%s), retrying in %s s", *self.address, e, retry_sleep)
+                if self.writer is not None:
+                    self.writer.close()
+                self.writer = None
+                await asyncio.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+
+async def serve_message_hub(sock):
+    """Relay each JSON line a connected worker sends to all connected workers, over a listening socket"""
+    writers = set()
+    
+    async def relay(reader, writer):
+        writers.add(writer)
+        try:
+            async for line in reader:
+                peers = list(writers)
+                for peer in peers:
+                    peer.write(line)
+                await asyncio.gather(*(peer.drain() for peer in peers), return_exceptions=True)
+        except (OSError, ValueError):
+            pass
+        finally:
+            writers.discard(writer)
+            writer.close()
+    
+    server = await asyncio.start_server(relay, sock=sock, limit=MESSAGE_HUB_LINE_LIMIT)
+    async with server:
+        await server.serve_forever()
+
+class WorkerEventsMixin:
+    """Carries worker-to-worker events over the Socket.IO message queue"""
+    async def publish_worker_event(self, name, data):
+        await self._publish({"method": "worker_event", "name": name, "data": data,
+                             "host_id": self.host_id})
+
+    async def _listen(self):
+        async for message in super()._listen():
+            event = message
+            if not isinstance(message, dict):
+                try:
+                    event = self.json.loads(message)
+                except ValueError:
+                    pass
+            if isinstance(event, dict) and event.get("method") == "worker_event":
+                if event.get("host_id") != self.host_id:
+                    try:
+                        await handle_worker_event(event["name"], event["data"])
+                    except Exception:
+                        logger.exception("Worker event %s failed", event.get("name"))
+                continue
+            yield message
+
+class LocalWorkerManager(WorkerEventsMixin, LocalPubSubManager):
+    pass
+
+class TcpWorkerManager(WorkerEventsMixin, TcpPubSubManager):
+    pass
+
+class RedisWorkerManager(WorkerEventsMixin, socketio.AsyncRedisManager):
+    pass
+
+def create_client_manager():
+    """Socket.IO client manager for SOCKETIO_MESSAGE_QUEUE; None keeps the in-process default"""
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return None
+    if SOCKETIO_MESSAGE_QUEUE == 'local':
+        return LocalWorkerManager()
+    if SOCKETIO_MESSAGE_QUEUE.startswith('tcp://'):
+        return TcpWorkerManager(SOCKETIO_MESSAGE_QUEUE)
+    return RedisWorkerManager(SOCKETIO_MESSAGE_QUEUE)
+
 # Socket.IO setup
 sio = socketio.AsyncServer(
+    client_manager=create_client_manager(),
     async_mode='asgi',
     cors_allowed_origins="*",
     logger=True,
-    engineio_logger=False
+    engineio_logger=False,
+    json=OrjsonCodec,
+    http_compression=SOCKETIO_COMPRESSION,
+    compression_threshold=SOCKETIO_COMPRESSION_THRESHOLD
 )
 
 # FastAPI app
@@ -58,14 +568,113 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RequestMetricsMiddleware:
+    """Record REST latency by route template; paths matching no route share one series"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_latency.observe(time.perf_counter() - started, scope["method"],
+                                         route.path if route else "unmatched", status_code)
+
+app.add_middleware(RequestMetricsMiddleware)
+
 # Mount Socket.IO
 socket_app = socketio.ASGIApp(sio, app)
 
 # Security
 security = HTTPBearer()
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_jobs = 0
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire after ttl seconds, with hit/miss counters"""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def info(self):
+        return {"size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses}
+
+# Users by id and user ids by token signature, for get_current_user
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+token_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
 
 # Game state management
+# active_games holds the authoritative state of every match being played,
+# keyed by match id. MongoDB is brought up to date by the write-behind flusher.
 active_games = {}
+dirty_games = set()
+background_tasks = []
+# Per-match locks serializing actions and joins; an idle lock is garbage collected
+match_locks = weakref.WeakValueDictionary()
+# Flushes run one at a time so two never compare-and-set the same version
+flush_lock = asyncio.Lock()
+# Sockets of the players watching each match: match_id -> {user_id: {sid}}
+match_player_sids = {}
+# Reverse index of match_player_sids: sid -> {match_id: user_id}
+sid_matches = {}
+# Sockets that negotiated msgpack-encoded event payloads at connect
+binary_sids = set()
+# Lobby index of waiting matches: summaries by id plus (created_at, id) keys kept sorted
+lobby_matches = {}
+lobby_keys = []
+# Most recent chat messages of the matches chatted in lately, served without touching MongoDB
+chat_buffers = TTLCache(CHAT_BUFFER_COUNT, CHAT_BUFFER_TTL)
+# Most recent deltas per match as (seq, delta, actor_id, private), for resuming clients
+match_deltas = {}
+# Chat messages waiting for the next batched insert
+pending_chat_messages = []
+# Match events waiting for the next batched append to the log
+pending_match_events = []
+# Round summaries waiting to be written with the events
+pending_match_rounds = []
+# Matchmaking queues of tickets keyed by (target_points, stake level); tickets
+# cancelled or matched elsewhere stay queued inactive until they reach the front
+matchmaking_queues = {}
+# Queued ticket of each waiting user
+matchmaking_tickets = {}
+# Match each recently paired user was placed in, for clients polling the queue
+matchmaking_results = TTLCache(USER_CACHE_SIZE, 300)
 
 # Enums
 class GameStatus(str, Enum):
@@ -93,6 +702,7 @@ class User(BaseModel):
     password_hash: str
     avatar: str = "avatar1"
     role: UserRole = UserRole.USER
+    is_bot: bool = False
     balance: float = 1000.0  # Start with $1000 for testing
     stats: Dict[str, Any] = Field(default_factory=lambda: {
         "matches_played": 0,
@@ -125,12 +735,21 @@ class Match(BaseModel):
     winner_id: Optional[str] = None
     players: List[str] = Field(default_factory=list)
     game_state: Dict[str, Any] = Field(default_factory=dict)
+    version: int = 0  # Bumped by every write of the document (compare-and-set)
+    snapshot_seq: int = 0  # Last event included in game_state; later ones are in match_events
+    round: int = 0  # Round being played, from 1
+    scores: Dict[str, int] = Field(default_factory=dict)  # Points totals, kept under target_points to win
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class MatchCreate(BaseModel):
     target_points: int
     stake_amount: float
 
+class MatchmakingRequest(BaseModel):
+    target_points: int
+    min_stake: float
+    max_stake: float
+
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     match_id: str
@@ -139,6 +758,34 @@ class ChatMessage(BaseModel):
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class MatchEvent(BaseModel):
+    match_id: str
+    seq: int  # 0 for the first deal, then one per action or later round deal
+    type: str  # deal, draw_stock, draw_discard, discard, close or forfeit
+    player_id: Optional[str] = None
+    card: Optional[str] = None
+    seed: Optional[int] = None  # Shuffle seed of the deal
+    players: Optional[List[str]] = None
+    timed_out: bool = False  # Played by the turn clock for an absent player
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class MatchRound(BaseModel):
+    match_id: str
+    round: int
+    seq: int  # Close event that ended the round
+    closer_id: str
+    points: Dict[str, int]  # Unmelded points each player scored
+    totals: Dict[str, int]
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Transaction(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: Optional[str] = None  # None for the house commission
+    match_id: Optional[str] = None
+    type: TransactionType
+    amount: float  # Signed change to the user's balance
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 # Spanish deck setup
 SUITS = ['oros', 'copas', 'espadas', 'bastos']
 RANKS = ['1', '2', '3', '4', '5', '6', '7', 'sota', 'caballo', 'rey']
@@ -149,126 +796,454 @@ SUIT_SYMBOLS = {
     'bastos': '🪄'
 }
 
+# Compact card model: card c is the int suit_index * 10 + rank_index and a
+# hand is a 40-bit mask with bit c set for every card held. Card dicts are
+# only built at the network and database boundary.
+RANKS_PER_SUIT = len(RANKS)
+DECK_SIZE = len(SUITS) * RANKS_PER_SUIT
+SUIT_BITS = (1 << RANKS_PER_SUIT) - 1
+SUIT_SHIFTS = [suit_index * RANKS_PER_SUIT for suit_index in range(len(SUITS))]
+RANK_POINTS = {rank: 10 if rank in ['sota', 'caballo', 'rey'] else int(rank) for rank in RANKS}
+CARD_SUITS = [suit for suit in SUITS for rank in RANKS]
+CARD_RANKS = [rank for suit in SUITS for rank in RANKS]
+CARD_IDS = [f"{suit}_{rank}" for suit, rank in zip(CARD_SUITS, CARD_RANKS)]
+CARD_INDEX = {card_id: card for card, card_id in enumerate(CARD_IDS)}
+CARD_BITS = {card_id: 1 << card for card, card_id in enumerate(CARD_IDS)}
+CARD_POINTS = [RANK_POINTS[rank] for rank in CARD_RANKS]
+CARD_DICTS = [{'suit': suit, 'rank': rank, 'id': card_id}
+              for suit, rank, card_id in zip(CARD_SUITS, CARD_RANKS, CARD_IDS)]
+SUIT_MASKS = [SUIT_BITS << shift for shift in SUIT_SHIFTS]
+RANK_MASKS = [sum(1 << (shift + rank_index) for shift in SUIT_SHIFTS)
+              for rank_index in range(RANKS_PER_SUIT)]
+# Point total of every possible 10-bit single-suit slice of a hand
+SUIT_SLICE_POINTS = [
+    sum(RANK_POINTS[RANKS[rank_index]] for rank_index in range(RANKS_PER_SUIT) if bits >> rank_index & 1)
+    for bits in range(1 << RANKS_PER_SUIT)
+]
+# Runs (3+ consecutive ranks) of a single suit, indexed by their lowest rank
+SUIT_RUNS_FROM = [
+    [((1 << length) - 1) << rank_index for length in range(3, RANKS_PER_SUIT - rank_index + 1)]
+    for rank_index in range(RANKS_PER_SUIT)
+]
+# Every meld whose lowest card is c: the runs starting at c plus the sets
+# completed with cards of the same rank from higher suits
+LOW_CARD_MELDS = [
+    [run << (card - card % RANKS_PER_SUIT) for run in SUIT_RUNS_FROM[card % RANKS_PER_SUIT]] +
+    [sum(1 << member for member in (card,) + others)
+     for size in range(2, len(SUITS))
+     for others in combinations(range(card + RANKS_PER_SUIT, DECK_SIZE, RANKS_PER_SUIT), size)]
+    for card in range(DECK_SIZE)
+]
+# Card count of every valid sequence and set mask, so a meld is validated by one lookup
+SEQUENCE_SIZES = {
+    run << shift: card_count
+    for shift in SUIT_SHIFTS
+    for runs in SUIT_RUNS_FROM
+    for card_count, run in enumerate(runs, start=3)
+}
+SET_SIZES = {
+    sum(1 << (shift + rank_index) for shift in shifts): len(shifts)
+    for rank_index in range(RANKS_PER_SUIT)
+    for size in range(3, len(SUITS) + 1)
+    for shifts in combinations(SUIT_SHIFTS, size)
+}
+CLOSE_MAX_POINTS = 7
+
 def create_spanish_deck():
     """Create a Spanish deck (40 cards)"""
-    deck = []
-    for suit in SUITS:
-        for rank in RANKS:
-            deck.append({'suit': suit, 'rank': rank, 'id': f"{suit}_{rank}"})
-    return deck
+    return list(range(DECK_SIZE))
+
+def hand_mask(cards):
+    """Build a hand mask from card ints"""
+    mask = 0
+    for card in cards:
+        mask |= 1 << card
+    return mask
+
+def mask_cards(mask):
+    """List the card ints of a hand mask in suit/rank order"""
+    cards = []
+    while mask:
+        low = mask & -mask
+        cards.append(low.bit_length() - 1)
+        mask ^= low
+    return cards
+
+def mask_to_dicts(mask):
+    """Convert a hand mask to a list of JSON card dicts"""
+    return [CARD_DICTS[card] for card in mask_cards(mask)]
+
+def mask_from_dicts(cards):
+    """Convert a list of JSON card dicts to a hand mask"""
+    mask = 0
+    for card in cards:
+        mask |= CARD_BITS[card['id']]
+    return mask
+
+def card_count(mask):
+    """Number of cards in a hand mask"""
+    return bin(mask).count('1')
+
+def mask_points(mask):
+    """Total point value of a hand mask"""
+    return sum(SUIT_SLICE_POINTS[(mask >> shift) & SUIT_BITS] for shift in SUIT_SHIFTS)
+
+def is_sequence_mask(mask):
+    """Check if a mask is a sequence (3+ consecutive ranks of one suit)"""
+    if card_count(mask) < 3:
+        return False
+    if not any(mask & ~suit_mask == 0 for suit_mask in SUIT_MASKS):
+        return False
+    # Adding the lowest bit to a contiguous run clears every bit of it
+    low = mask & -mask
+    return (mask + low) & mask == 0
 
 def card_value(rank):
     """Get the point value of a card in Chinchón"""
-    if rank in ['sota', 'caballo', 'rey']:
-        return 10
-    return int(rank)
+    return RANK_POINTS[rank]
 
 def calculate_hand_value(hand):
     """Calculate the total point value of a hand"""
-    return sum(card_value(card['rank']) for card in hand)
+    return sum(CARD_POINTS[CARD_INDEX[card['id']]] for card in hand)
+
+def search_melds(mask):
+    """Find the non-overlapping melds of a hand mask that leave the fewest points.
+
+    Returns (unmelded_points, melds) with melds a tuple of sequence and set
+    masks. The lowest card of the hand is either left unmelded or belongs
+    to one of LOW_CARD_MELDS, so each step only tries those few melds.
+    """
+    if not mask:
+        return 0, ()
+    low = mask & -mask
+    card = low.bit_length() - 1
+    points, melds = search_melds(mask ^ low)
+    best_points, best_melds = points + CARD_POINTS[card], melds
+    for meld in LOW_CARD_MELDS[card]:
+        if meld & mask == meld:
+            points, melds = search_melds(mask & ~meld)
+            if points < best_points:
+                best_points, best_melds = points, (meld,) + melds
+                if not best_points:
+                    break
+    return best_points, best_melds
+
+# Memoized on the hand mask, which is already canonical (order independent)
+solve_melds = lru_cache(maxsize=MELD_CACHE_SIZE)(search_melds)
 
 def find_best_melds(hand):
     """Find the best combination of melds to minimize points"""
-    # This is a simplified version - full implementation would be more complex
-    sequences = []
-    sets = []
-    
-    # Group by suit for sequences
-    by_suit = {}
-    for card in hand:
-        if card['suit'] not in by_suit:
-            by_suit[card['suit']] = []
-        by_suit[card['suit']].append(card)
-    
-    # Group by rank for sets
-    by_rank = {}
-    for card in hand:
-        if card['rank'] not in by_rank:
-            by_rank[card['rank']] = []
-        by_rank[card['rank']].append(card)
-    
-    # Find sequences (3+ consecutive cards of same suit)
-    rank_values = {'1': 1, '2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, 'sota': 8, 'caballo': 9, 'rey': 10}
-    
-    for suit, cards in by_suit.items():
-        if len(cards) >= 3:
-            sorted_cards = sorted(cards, key=lambda x: rank_values[x['rank']])
-            # Simple sequence detection
-            consecutive = [sorted_cards[0]]
-            for i in range(1, len(sorted_cards)):
-                if rank_values[sorted_cards[i]['rank']] - rank_values[consecutive[-1]['rank']] == 1:
-                    consecutive.append(sorted_cards[i])
-                else:
-                    if len(consecutive) >= 3:
-                        sequences.append(consecutive.copy())
-                    consecutive = [sorted_cards[i]]
-            if len(consecutive) >= 3:
-                sequences.append(consecutive)
-    
-    # Find sets (3+ cards of same rank)
-    for rank, cards in by_rank.items():
-        if len(cards) >= 3:
-            sets.append(cards)
-    
+    points, melds = solve_melds(mask_from_dicts(hand))
+    sequences = [mask_to_dicts(meld) for meld in melds if is_sequence_mask(meld)]
+    sets = [mask_to_dicts(meld) for meld in melds if not is_sequence_mask(meld)]
     return sequences, sets
 
 def is_valid_sequence(cards):
     """Check if cards form a valid sequence (same suit, consecutive ranks)"""
-    if len(cards) < 3:
-        return False
+    mask = 0
+    for card in cards:
+        mask |= CARD_BITS[card['id']]
+    # A repeated card leaves the mask with fewer cards than the meld
+    return SEQUENCE_SIZES.get(mask) == len(cards)
+
+def is_valid_set(cards):
+    """Check if cards form a valid set (same rank, different suits)"""
+    mask = 0
+    for card in cards:
+        mask |= CARD_BITS[card['id']]
+    return SET_SIZES.get(mask) == len(cards)
+
+def calculate_unmelded_points(hand, sequences=None, sets=None):
+    """Calculate points for cards not in melds"""
+    melded = 0
+    for meld in (sequences or []) + (sets or []):
+        melded |= mask_from_dicts(meld)
+    return mask_points(mask_from_dicts(hand) & ~melded)
+
+# Best points meldable in runs of every 10-bit single-suit slice
+SUIT_RUN_POINTS = [SUIT_SLICE_POINTS[bits] - search_melds(bits)[0] for bits in range(1 << RANKS_PER_SUIT)]
+# For every slice, each rank held and the run points lost when it is taken out
+SUIT_RUN_LOSSES = [
+    [(rank_index, SUIT_RUN_POINTS[bits] - SUIT_RUN_POINTS[bits & ~(1 << rank_index)])
+     for rank_index in range(RANKS_PER_SUIT) if bits >> rank_index & 1]
+    for bits in range(1 << RANKS_PER_SUIT)
+]
+# Set masks of each rank with their points
+RANK_SETS = [
+    [(meld, mask_points(meld)) for meld in SET_SIZES if meld & RANK_MASKS[rank_index] == meld]
+    for rank_index in range(RANKS_PER_SUIT)
+]
+
+def run_points(mask):
+    """Best points a hand melds in runs alone, one table lookup per suit"""
+    return sum(SUIT_RUN_POINTS[(mask >> shift) & SUIT_BITS] for shift in SUIT_SHIFTS)
+
+def set_choices(mask):
+    """Ways to meld sets in a hand, as (set points, cards left for runs).
     
-    rank_values = {'1': 1, '2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, 'sota': 8, 'caballo': 9, 'rey': 10}
-    sorted_cards = sorted(cards, key=lambda x: rank_values[x['rank']])
+    Only ranks held in three or more suits can form a set, so a hand has
+    a handful of choices: no set, each contained set and each disjoint
+    pair. Returns None for hands that could hold three sets (9+ cards).
+    """
+    oros, copas, espadas, bastos = ((mask >> shift) & SUIT_BITS for shift in SUIT_SHIFTS)
+    ranks = (oros & copas & (espadas | bastos)) | (espadas & bastos & (oros | copas))
+    choices = [(0, mask)]
+    if not ranks:
+        return choices
+    if card_count(ranks) > 2:
+        return None
+    sets = [(meld, points) for rank_index in mask_cards(ranks)
+            for meld, points in RANK_SETS[rank_index] if meld & mask == meld]
+    for index, (first, first_points) in enumerate(sets):
+        choices.append((first_points, mask & ~first))
+        for second, second_points in sets[index + 1:]:
+            if not first & second:
+                choices.append((first_points + second_points, mask & ~first & ~second))
+    return choices
+
+def evaluate_hand(hand):
+    """Unmelded points and close eligibility of a hand.
     
-    # Check same suit and consecutive
-    suit = sorted_cards[0]['suit']
-    if not all(card['suit'] == suit for card in sorted_cards):
-        return False
+    Points are the run tables of each suit tried with every set choice of
+    the hand. A hand holding a drawn card also gets the points each discard
+    would leave, so the discard ending the turn and a close are lookups:
+    a discard only changes its own suit slice, so every entry comes from
+    SUIT_RUN_LOSSES rather than a new search.
+    """
+    choices = set_choices(hand)
+    if choices is None:
+        points = solve_melds(hand)[0]
+        discards = {card: solve_melds(hand & ~(1 << card))[0] for card in mask_cards(hand)}
+        return {"points": points, "can_close": points <= CLOSE_MAX_POINTS, "discards": discards}
     
-    for i in range(1, len(sorted_cards)):
-        if rank_values[sorted_cards[i]['rank']] - rank_values[sorted_cards[i-1]['rank']] != 1:
-            return False
+    total = mask_points(hand)
+    melded = 0
+    # Best points still melded once each card is discarded; the first
+    # choice (no set) holds every card, so each one gets an entry
+    melded_without = {}
+    for set_points, rest in choices:
+        slices = [((rest >> shift) & SUIT_BITS, shift) for shift in SUIT_SHIFTS]
+        choice_melded = set_points
+        for bits, _ in slices:
+            choice_melded += SUIT_RUN_POINTS[bits]
+        if choice_melded > melded:
+            melded = choice_melded
+        for bits, shift in slices:
+            for rank_index, loss in SUIT_RUN_LOSSES[bits]:
+                card = shift + rank_index
+                if choice_melded - loss > melded_without.get(card, -1):
+                    melded_without[card] = choice_melded - loss
+    points = total - melded
+    discards = None
+    if card_count(hand) > 7:
+        discards = {card: total - CARD_POINTS[card] - left for card, left in melded_without.items()}
+    return {"points": points, "can_close": points <= CLOSE_MAX_POINTS, "discards": discards}
+
+def evaluate_discard(evaluation, hand, card):
+    """Evaluation of the hand left by discarding card, looked up in the previous evaluation"""
+    discards = evaluation.get("discards") if evaluation else None
+    if not discards or card not in discards:
+        return evaluate_hand(hand)
+    points = discards[card]
+    return {"points": points, "can_close": points <= CLOSE_MAX_POINTS, "discards": None}
+
+def hand_hint(player):
+    """Points and close eligibility pushed to the player holding the hand"""
+    evaluation = player.get("eval") or evaluate_hand(player["hand"])
+    return {"points": evaluation["points"], "can_close": evaluation["can_close"]}
+
+def best_discard(hand):
+    """Card whose discard leaves the fewest unmelded points, the highest on ties"""
+    return min(mask_cards(hand), key=lambda card: (solve_melds(hand & ~(1 << card))[0], -CARD_POINTS[card]))
+
+# Batch evaluation tables
+CARD_SHIFT_ARRAY = np.arange(DECK_SIZE, dtype=np.uint64)
+SUIT_SHIFT_ARRAY = np.array(SUIT_SHIFTS, dtype=np.uint64)
+SET_MASK_ARRAY = np.array(list(SET_SIZES), dtype=np.uint64)
+SET_POINTS_ARRAY = np.array([mask_points(meld) for meld in SET_SIZES], dtype=np.int32)
+# Point total, card count and best points meldable in runs of every 10-bit single-suit slice
+SUIT_SLICE_POINTS_ARRAY = np.array(SUIT_SLICE_POINTS, dtype=np.int32)
+SUIT_SLICE_COUNTS_ARRAY = np.array([card_count(bits) for bits in range(1 << RANKS_PER_SUIT)], dtype=np.int32)
+SUIT_RUN_POINTS_ARRAY = np.array(SUIT_RUN_POINTS, dtype=np.int32)
+# Hands scored per vectorized step; bounds the (hands x sets) temporaries
+BATCH_CHUNK_SIZE = 65536
+
+def hands_to_masks(hands):
+    """Convert an (N, 40) one-hot array or an (N,) array of bitmasks to uint64 hand masks"""
+    hands = np.asarray(hands)
+    if hands.ndim == 2:
+        if hands.shape[1] != DECK_SIZE:
+            raise ValueError(f"One-hot hands must have {DECK_SIZE} columns")
+        return (hands.astype(bool).astype(np.uint64) << CARD_SHIFT_ARRAY).sum(axis=1, dtype=np.uint64)
+    if hands.ndim == 1:
+        return hands.astype(np.uint64)
+    raise ValueError("Hands must be an (N, 40) one-hot array or an (N,) array of bitmasks")
+
+def suit_slices(masks):
+    """(4, N) array of the 10-bit single-suit slices of each hand mask, as table indexes"""
+    return ((masks >> SUIT_SHIFT_ARRAY[:, None]) & np.uint64(SUIT_BITS)).astype(np.intp)
+
+def best_melded_points_batch(masks, slices):
+    """Highest point total that can be melded in each hand, and the hands this misses.
+
+    Runs stay within a suit, so without sets the best is a per-suit table
+    lookup. Only hands holding a rank in three suits can meld a set; for
+    those every contained set, and every disjoint pair of them, is tried
+    with the runs of the cards left. Hands that could hold three sets
+    (9+ cards) are returned as not covered.
+    """
+    best = SUIT_RUN_POINTS_ARRAY[slices].sum(axis=0)
+    oros, copas, espadas, bastos = slices
+    set_ranks = (oros & copas & (espadas | bastos)) | (espadas & bastos & (oros | copas))
+    candidates = np.nonzero(set_ranks)[0]
+    uncovered = candidates[SUIT_SLICE_COUNTS_ARRAY[set_ranks[candidates]] > 2]
+    if not len(candidates):
+        return best, uncovered
     
-    return True
+    hands = masks[candidates]
+    rows, sets = np.nonzero((hands[:, None] & SET_MASK_ARRAY) == SET_MASK_ARRAY)
+    rest = hands[rows] & ~SET_MASK_ARRAY[sets]
+    np.maximum.at(best, candidates[rows], SET_POINTS_ARRAY[sets] + SUIT_RUN_POINTS_ARRAY[suit_slices(rest)].sum(axis=0))
+    # rows is sorted, so the sets of one hand are adjacent: pairing each entry
+    # with the one `offset` places later visits every pair within a hand
+    for offset in range(1, int(np.bincount(rows).max())):
+        same_hand = rows[offset:] == rows[:-offset]
+        first, second = sets[:-offset][same_hand], sets[offset:][same_hand]
+        # Two sets of the same rank always share a card
+        disjoint = (SET_MASK_ARRAY[first] & SET_MASK_ARRAY[second]) == 0
+        first, second = first[disjoint], second[disjoint]
+        pair_rows = rows[offset:][same_hand][disjoint]
+        rest = hands[pair_rows] & ~(SET_MASK_ARRAY[first] | SET_MASK_ARRAY[second])
+        np.maximum.at(best, candidates[pair_rows], SET_POINTS_ARRAY[first] + SET_POINTS_ARRAY[second] +
+                      SUIT_RUN_POINTS_ARRAY[suit_slices(rest)].sum(axis=0))
+    return best, uncovered
 
-def is_valid_set(cards):
-    """Check if cards form a valid set (same rank, different suits)"""
-    if len(cards) < 3:
-        return False
+def evaluate_hands_batch(hands):
+    """Score many hands in one vectorized call.
+
+    hands is an (N, 40) one-hot array or an (N,) array of hand bitmasks.
+    Returns (points, unmelded_points, can_close) arrays of length N: the raw
+    hand value as in calculate_hand_value, the fewest unmelded points over
+    all meld partitions and whether the hand is eligible to close.
+    """
+    masks = hands_to_masks(hands)
+    points = np.empty(len(masks), dtype=np.int32)
+    unmelded_points = np.empty(len(masks), dtype=np.int32)
+    for start in range(0, len(masks), BATCH_CHUNK_SIZE):
+        chunk = masks[start:start + BATCH_CHUNK_SIZE]
+        slices = suit_slices(chunk)
+        chunk_points = SUIT_SLICE_POINTS_ARRAY[slices].sum(axis=0)
+        melded_points, uncovered = best_melded_points_batch(chunk, slices)
+        points[start:start + len(chunk)] = chunk_points
+        unmelded_points[start:start + len(chunk)] = chunk_points - melded_points
+        # Hands that could hold three sets are solved exactly one by one
+        for index in uncovered + start:
+            unmelded_points[index] = solve_melds(int(masks[index]))[0]
+    return points, unmelded_points, unmelded_points <= CLOSE_MAX_POINTS
+
+def new_deal_seed():
+    """Shuffle seed of a new deal, kept in the match event log for replay"""
+    return secrets.randbits(63)
+
+def deal_game(players, seed, previous=None):
+    """Shuffle a deck from the seed and deal a round of a two-player match.
     
-    rank = cards[0]['rank']
-    suits = set()
+    Without a previous round's state this is the opening deal; otherwise the
+    players' totals and timeout counts carry over and the other player starts.
+    """
+    round_number = previous.get("round", 1) + 1 if previous else 1
+    carried = previous["players"] if previous else {}
+    deck = create_spanish_deck()
+    random.Random(seed).shuffle(deck)
     
-    for card in cards:
-        if card['rank'] != rank:
-            return False
-        if card['suit'] in suits:
-            return False
-        suits.add(card['suit'])
+    # Deal 7 cards to each player
+    player1_hand = hand_mask(deck[:7])
+    player2_hand = hand_mask(deck[7:14])
+    discard_pile = [deck[14]]
+    stock_pile = deck[15:]
     
-    return True
+    return {
+        "deck": stock_pile,
+        "discard_pile": discard_pile,
+        "players": {
+            players[0]: {
+                "hand": player1_hand,
+                "eval": evaluate_hand(player1_hand),
+                "points": carried.get(players[0], {}).get("points", 0),
+                "timeouts": carried.get(players[0], {}).get("timeouts", 0),
+                "ready": False
+            },
+            players[1]: {
+                "hand": player2_hand,
+                "eval": evaluate_hand(player2_hand),
+                "points": carried.get(players[1], {}).get("points", 0),
+                "timeouts": carried.get(players[1], {}).get("timeouts", 0),
+                "ready": False
+            }
+        },
+        "round": round_number,
+        "current_turn": players[(round_number - 1) % 2],
+        "turn_start_time": datetime.utcnow().isoformat(),
+        "turn_action_taken": False,
+        "phase": "draw"  # draw, discard, or close
+    }
 
-def calculate_unmelded_points(hand, sequences=None, sets=None):
-    """Calculate points for cards not in melds"""
-    if not sequences:
-        sequences = []
-    if not sets:
-        sets = []
-    
-    melded_cards = set()
-    for seq in sequences:
-        for card in seq:
-            melded_cards.add(card['id'])
-    for s in sets:
-        for card in s:
-            melded_cards.add(card['id'])
-    
-    unmelded_points = 0
-    for card in hand:
-        if card['id'] not in melded_cards:
-            unmelded_points += card_value(card['rank'])
-    
-    return unmelded_points
+def close_round(match, closer_id):
+    """Score a closed round into the players' totals and return its summary.
+    
+    Each player scores the unmelded points of their hand. Closing with none
+    (chinchón) wins the match outright; otherwise it ends once a total
+    reaches target_points, won by the lowest total (the closer on a tie).
+    """
+    game_state = match["game_state"]
+    points = {player_id: hand_hint(player)["points"] for player_id, player in game_state["players"].items()}
+    for player_id, player in game_state["players"].items():
+        player["points"] = player.get("points", 0) + points[player_id]
+    totals = {player_id: player["points"] for player_id, player in game_state["players"].items()}
+    
+    winner_id = None
+    if points[closer_id] == 0:
+        winner_id = closer_id
+    elif max(totals.values()) >= match["target_points"]:
+        winner_id = min(totals, key=lambda player_id: (totals[player_id], player_id != closer_id))
+    if winner_id:
+        match["status"] = GameStatus.FINISHED
+        match["winner_id"] = winner_id
+    return {"round": game_state.get("round", 1), "closer_id": closer_id, "points": points, "totals": totals}
+
+def encode_game_state(game_state):
+    """Convert an in-memory game state to its JSON/document format"""
+    if not game_state:
+        return game_state
+    state = dict(game_state)
+    state["deck"] = [CARD_DICTS[card] for card in game_state["deck"]]
+    state["discard_pile"] = [CARD_DICTS[card] for card in game_state["discard_pile"]]
+    # Hand evaluations are derived, so they are rebuilt rather than stored
+    state["players"] = {
+        player_id: {**{key: value for key, value in player.items() if key != "eval"},
+                    "hand": mask_to_dicts(player["hand"])}
+        for player_id, player in game_state["players"].items()
+    }
+    return state
+
+def decode_game_state(state):
+    """Convert a JSON/document game state to its in-memory format"""
+    if not state:
+        return state
+    game_state = dict(state)
+    game_state["deck"] = [CARD_INDEX[card['id']] for card in state["deck"]]
+    game_state["discard_pile"] = [CARD_INDEX[card['id']] for card in state["discard_pile"]]
+    game_state["players"] = {
+        player_id: {**player, "hand": mask_from_dicts(player["hand"])}
+        for player_id, player in state["players"].items()
+    }
+    for player in game_state["players"].values():
+        player["eval"] = evaluate_hand(player["hand"])
+    return game_state
+
+def match_document(match):
+    """Return an in-memory match in its JSON/document format"""
+    return {**match, "game_state": encode_game_state(match.get("game_state"))}
 
 # Utility functions
 def hash_password(password: str) -> str:
@@ -277,6 +1252,21 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
+async def run_password_job(func, *args):
+    """Run bcrypt work off the event loop, failing fast when the pool is saturated"""
+    global password_jobs
+    if password_jobs >= PASSWORD_HASH_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -287,24 +1277,876 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
+async def invalidate_user(user_id):
+    """Drop a cached user, on every worker, after its balance, stats or profile changed"""
+    user_cache.pop(user_id)
+    await publish_worker_event("invalidate_user", user_id)
+
+def is_duplicate_key_error(error):
+    """Whether a write failed only because of unique index violations"""
+    if isinstance(error, DuplicateKeyError):
+        return True
+    write_errors = error.details.get("writeErrors", [])
+    return bool(write_errors) and all(write_error["code"] == 11000 for write_error in write_errors)
+
+def require_admin(user: User):
+    if user.role not in (UserRole.ADMIN, UserRole.SUPER_ADMIN):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+async def ensure_indexes():
+    """Create the declared indexes of every collection (no-op when they exist)"""
+    for collection, indexes in COLLECTION_INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except Exception:
+            logger.exception("Could not ensure indexes on %s", collection)
+
+async def user_from_token(token):
+    """The user a JWT was issued to, or None if the token is invalid or the user is gone"""
+    signature = token.rpartition(".")[2]
+    user_id = token_cache.get(signature)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        user_id = payload.get("sub")
         if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+            return None
+        # Never cache a token beyond its own expiry
+        token_cache.set(signature, user_id, ttl=min(USER_CACHE_TTL, payload["exp"] - time.time()))
     
-    user = await db.users.find_one({"id": user_id})
+    user = user_cache.get(user_id)
     if user is None:
-        raise credentials_exception
-    return User(**user)
+        user = await db.users.find_one({"id": user_id})
+        if user is None:
+            return None
+        user = User(**user)
+        user_cache.set(user_id, user)
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user = await user_from_token(credentials.credentials)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+# Active game store
+async def load_active_game(match_id):
+    """Return the in-memory match being played, loading it from MongoDB on first use"""
+    match = active_games.get(match_id)
+    if match is None:
+        match = await db.matches.find_one({"id": match_id}, {"_id": 0})
+        if not match or match.get("status") != GameStatus.PLAYING:
+            return None
+        match["game_state"] = decode_game_state(match.get("game_state"))
+        # Events logged after the last snapshot bring the state up to date
+        await replay_events(match, match.get("snapshot_seq", 0))
+        match = active_games.setdefault(match_id, match)
+        if match["status"] != GameStatus.PLAYING:
+            # The log ended the match before its final write: store and settle it now
+            mark_game_dirty(match_id)
+            await finish_active_game(match_id)
+            return None
+        schedule_turn_timeout(match)
+        schedule_bot_turn(match)
+    return match
+
+def match_lock(match_id):
+    """Lock serializing the actions and joins of one match"""
+    lock = match_locks.get(match_id)
+    if lock is None:
+        lock = match_locks[match_id] = asyncio.Lock()
+    return lock
+
+def version_filter(match_id, version):
+    """Compare-and-set filter; documents written before versioning count as version 0"""
+    return {"id": match_id, "version": version if version else {"$in": [0, None]}}
+
+def mark_game_dirty(match_id):
+    """Queue a match for the next write-behind flush"""
+    dirty_games.add(match_id)
+
+async def flush_games(match_ids=None):
+    """Persist pending in-memory match changes with a single bulk write.
+    
+    Every update is a compare-and-set on the version this worker last wrote.
+    A match whose stored version moved on was written by someone else, so its
+    in-memory copy is stale and is dropped instead of overwriting the document.
+    Returns the ids of the matches whose state is now stored.
+    """
+    async with flush_lock:
+        if match_ids is None:
+            match_ids = list(dirty_games)
+        # The log goes first, so a document never points past its events
+        await flush_match_events()
+        operations = []
+        snapshots = []
+        snapshot_seqs = {}
+        flushed = {}
+        for match_id in match_ids:
+            dirty_games.discard(match_id)
+            match = active_games.get(match_id)
+            if match is None:
+                continue
+            version = match.get("version", 0)
+            seq = match.get("seq", 0)
+            flushed[match_id] = version + 1
+            update = {
+                "status": match["status"],
+                "winner_id": match.get("winner_id"),
+                "round": match["game_state"].get("round", 1),
+                "scores": {player_id: player.get("points", 0)
+                           for player_id, player in match["game_state"]["players"].items()},
+                "seq": seq,
+                "version": version + 1
+            }
+            if match["status"] != GameStatus.PLAYING or seq - match.get("snapshot_seq", 0) >= MATCH_SNAPSHOT_INTERVAL:
+                # Encoding also snapshots the state: motor encodes documents off the event loop
+                game_state = encode_game_state(match["game_state"])
+                update.update(game_state=game_state, snapshot_seq=seq)
+                snapshot_seqs[match_id] = seq
+                snapshots.append(InsertOne({
+                    "match_id": match_id,
+                    "seq": seq,
+                    "game_state": game_state,
+                    "status": match["status"],
+                    "winner_id": match.get("winner_id"),
+                    "created_at": datetime.utcnow()
+                }))
+            operations.append(UpdateOne(version_filter(match_id, version), {"$set": update}))
+        if not operations:
+            return set()
+        try:
+            if snapshots:
+                try:
+                    await db.match_snapshots.bulk_write(snapshots, ordered=False)
+                except (BulkWriteError, DuplicateKeyError) as e:
+                    # Taken by an earlier attempt of this flush
+                    if not is_duplicate_key_error(e):
+                        raise
+            result = await db.matches.bulk_write(operations, ordered=False)
+        except Exception:
+            logger.exception("Failed to flush %d matches, retrying on next flush", len(operations))
+            dirty_games.update(match_id for match_id in match_ids if match_id in active_games)
+            return set()
+        
+        written = set()
+        stored = {}
+        if result.matched_count < len(operations):
+            stored = {
+                match["id"]: match.get("version")
+                for match in await db.matches.find(
+                    {"id": {"$in": list(flushed)}}, {"_id": 0, "id": 1, "version": 1}
+                ).to_list(None)
+            }
+        for match_id, version in flushed.items():
+            match = active_games.get(match_id)
+            if match is None:
+                continue
+            if stored and stored.get(match_id) != version:
+                logger.warning("Dropping stale state of match %s: stored version %s, expected %s",
+                               match_id, stored.get(match_id), version - 1)
+                active_games.pop(match_id, None)
+                match_deltas.pop(match_id, None)
+                dirty_games.discard(match_id)
+            else:
+                match["version"] = version
+                if match_id in snapshot_seqs:
+                    match["snapshot_seq"] = snapshot_seqs[match_id]
+                written.add(match_id)
+        return written
+
+async def load_chat_buffer(match_id, create=False):
+    """Return the chat ring buffer of a match, filling it from MongoDB on first use.
+    
+    A match without messages only gets a buffer when create is set, so reads
+    of unknown or silent matches cache nothing and return None.
+    """
+    buffer = chat_buffers.get(match_id)
+    if buffer is None:
+        messages = await db.chat_messages.find(
+            {"match_id": match_id}, {"_id": 0}
+        ).sort("created_at", -1).limit(CHAT_HISTORY_SIZE).to_list(CHAT_HISTORY_SIZE)
+        messages.reverse()
+        # An evicted buffer may have messages not inserted yet
+        messages.extend({key: value for key, value in message.items() if key != "_id"}
+                        for message in pending_chat_messages if message["match_id"] == match_id)
+        buffer = chat_buffers.get(match_id)
+        if buffer is None:
+            if not messages and not create:
+                return None
+            buffer = deque(messages, maxlen=CHAT_HISTORY_SIZE)
+            chat_buffers.set(match_id, buffer)
+    return buffer
+
+async def match_exists(match_id):
+    """Whether a match was ever created, checking memory before MongoDB"""
+    if match_id in active_games or match_id in lobby_matches:
+        return True
+    return await db.matches.find_one({"id": match_id}, {"_id": 0, "id": 1}) is not None
+
+async def flush_chat_messages():
+    """Insert pending chat messages in one batch; old ones expire through the TTL index"""
+    if not pending_chat_messages:
+        return
+    batch = pending_chat_messages[:]
+    pending_chat_messages.clear()
+    try:
+        await db.chat_messages.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        # Duplicates were inserted by an earlier attempt; retry anything else
+        errors = e.details.get("writeErrors", [])
+        pending_chat_messages.extend(batch[error["index"]] for error in errors if error["code"] != 11000)
+    except Exception:
+        logger.exception("Failed to insert %d chat messages, retrying on next flush", len(batch))
+        pending_chat_messages[:0] = batch
+
+def record_match_event(match_id, seq, event_type, **fields):
+    """Append an action to the match event log; flush_games writes it in batches"""
+    pending_match_events.append(MatchEvent(match_id=match_id, seq=seq, type=event_type, **fields).dict())
+
+def record_deal(match_id, players, seed, game_state):
+    """Log a deal as event 0; its time is the first turn's start"""
+    record_match_event(match_id, 0, "deal", players=list(players), seed=seed,
+                       created_at=datetime.fromisoformat(game_state["turn_start_time"]))
+
+def record_round(match_id, seq, round_result):
+    """Queue the compact summary of a finished round; written with the match events"""
+    pending_match_rounds.append(MatchRound(match_id=match_id, seq=seq, **round_result).dict())
+
+def start_next_round(match):
+    """Re-deal a match in memory for its next round and log the deal"""
+    seed = new_deal_seed()
+    match["game_state"] = deal_game(match["players"], seed, match["game_state"])
+    match["seq"] += 1
+    record_match_event(match["id"], match["seq"], "deal", players=list(match["players"]), seed=seed,
+                       created_at=datetime.fromisoformat(match["game_state"]["turn_start_time"]))
+
+async def append_log(collection, pending, name):
+    """Insert pending log documents in one batch, keeping failed ones for the next flush"""
+    if not pending:
+        return
+    batch = pending[:]
+    pending.clear()
+    try:
+        await collection.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        # Duplicates were appended by an earlier attempt; retry anything else
+        errors = e.details.get("writeErrors", [])
+        pending.extend(batch[error["index"]] for error in errors if error["code"] != 11000)
+    except Exception:
+        logger.exception("Failed to append %d %s, retrying on next flush", len(batch), name)
+        pending[:0] = batch
+
+async def flush_match_events():
+    """Append pending match events and round summaries in one batch each"""
+    await append_log(db.match_events, pending_match_events, "match events")
+    await append_log(db.match_rounds, pending_match_rounds, "match rounds")
+
+async def apply_match_event(match, event):
+    """Re-apply one logged event to a match being rebuilt"""
+    game_state = match["game_state"]
+    player_id = event.get("player_id")
+    if event["type"] == "deal":
+        # Deals after the first start the next round of the same match
+        match["game_state"] = deal_game(event["players"], event["seed"], game_state if event["seq"] else None)
+        match["game_state"]["turn_start_time"] = event["created_at"].isoformat()
+    elif event["type"] in ("draw_stock", "draw_discard"):
+        draw = handle_draw_stock if event["type"] == "draw_stock" else handle_draw_discard
+        card = await draw(match["id"], player_id, game_state)
+        if CARD_IDS[card] != event["card"]:
+            raise Exception(f"Event {event['seq']} of match {match['id']} does not match the deal")
+    elif event["type"] == "discard":
+        await handle_discard(match["id"], player_id, event["card"], game_state)
+        game_state["turn_start_time"] = event["created_at"].isoformat()
+        count_turn_timeout(game_state, player_id, event.get("timed_out", False))
+    elif event["type"] == "close":
+        close_round(match, player_id)
+    elif event["type"] == "forfeit":
+        match["status"] = GameStatus.FINISHED
+        match["winner_id"] = next(other_id for other_id in game_state["players"] if other_id != player_id)
+    match["seq"] = event["seq"]
+
+async def replay_events(match, after_seq, until_seq=None):
+    """Apply the logged events of a match after after_seq, up to until_seq"""
+    seq_range = {"$gt": after_seq}
+    if until_seq is not None:
+        seq_range["$lte"] = until_seq
+    events = db.match_events.find({"match_id": match["id"], "seq": seq_range}, {"_id": 0}).sort("seq", 1)
+    async for event in events:
+        await apply_match_event(match, event)
+    return match
+
+async def replay_match(match_id, seq=None):
+    """Rebuild a match as it was after event seq (default: the last) from its latest snapshot and the log"""
+    query = {"match_id": match_id}
+    if seq is not None:
+        query["seq"] = {"$lte": seq}
+    snapshot = await db.match_snapshots.find_one(query, {"_id": 0}, sort=[("seq", -1)])
+    document = await db.matches.find_one({"id": match_id}, {"_id": 0, "target_points": 1})
+    match = {"id": match_id, "game_state": {}, "status": GameStatus.PLAYING, "winner_id": None, "seq": -1,
+             "target_points": document["target_points"] if document else 0}
+    if snapshot:
+        match.update(
+            game_state=decode_game_state(snapshot["game_state"]),
+            status=snapshot["status"],
+            winner_id=snapshot.get("winner_id"),
+            seq=snapshot["seq"]
+        )
+    return await replay_events(match, match["seq"], seq)
+
+async def write_behind_flusher():
+    """Periodically persist dirty matches and chat every GAME_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(GAME_FLUSH_INTERVAL)
+        written = await flush_games()
+        await flush_chat_messages()
+        # Finished matches whose earlier final write failed
+        await release_finished_games(written)
+
+async def finish_active_game(match_id):
+    """Persist a finished match immediately, then drop it from memory and settle it.
+    
+    If the write fails the match stays in memory and dirty, and is finished
+    by the write-behind flusher once a retry is stored.
+    """
+    written = await flush_games([match_id])
+    await flush_chat_messages()
+    await release_finished_games(written)
+
+async def release_finished_games(match_ids):
+    """Settle and drop the finished matches among match_ids, whose final state is stored"""
+    for match_id in match_ids:
+        match = active_games.get(match_id)
+        if match is None or match["status"] == GameStatus.PLAYING:
+            continue
+        try:
+            await settle_match(match_id, match["winner_id"], match=match)
+        except Exception:
+            # Stored again on the next flush, which retries the settlement
+            logger.exception("Failed to settle match %s, retrying on next flush", match_id)
+            mark_game_dirty(match_id)
+            continue
+        active_games.pop(match_id)
+        match_deltas.pop(match_id, None)
+        chat_buffers.pop(match_id)
+        await lobby_remove(match_id)
+
+# Turn clock
+class TimerWheel:
+    """Hashed timer wheel of deadlines keyed by id, advanced by a single task.
+
+    A deadline goes in the slot of the tick it falls due in; slots wrap around,
+    so an entry more than one lap away stays put until its own tick comes.
+    Scheduling, rescheduling and cancelling are O(1).
+    """
+    def __init__(self, tick, slots, now):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.due_ticks = {}
+        self.next_tick = math.floor(now / tick)
+
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        due_tick = max(math.ceil(deadline / self.tick), self.next_tick)
+        self.due_ticks[key] = due_tick
+        self.slots[due_tick % len(self.slots)].add(key)
+
+    def cancel(self, key):
+        due_tick = self.due_ticks.pop(key, None)
+        if due_tick is not None:
+            self.slots[due_tick % len(self.slots)].discard(key)
+
+    def advance(self, now):
+        """Remove and return the keys whose deadline has passed"""
+        expired = []
+        while self.next_tick <= math.floor(now / self.tick):
+            slot = self.slots[self.next_tick % len(self.slots)]
+            for key in [key for key in slot if self.due_ticks[key] <= self.next_tick]:
+                slot.discard(key)
+                del self.due_ticks[key]
+                expired.append(key)
+            self.next_tick += 1
+        return expired
+
+    def __len__(self):
+        return len(self.due_ticks)
+
+turn_timers = TimerWheel(TURN_TIMER_TICK, TURN_TIMER_SLOTS, time.time())
+# Turns running when the server starts get a full timeout from then on
+turn_clock_started_at = time.time()
+
+def turn_deadline(game_state):
+    """Epoch seconds at which the current turn runs out"""
+    turn_start = datetime.fromisoformat(game_state["turn_start_time"]).replace(tzinfo=timezone.utc).timestamp()
+    return max(turn_start, turn_clock_started_at) + TURN_TIMEOUT_SECONDS
+
+def schedule_turn_timeout(match):
+    """Track the deadline of a match's current turn, or drop it once the match is over"""
+    if TURN_TIMEOUT_SECONDS <= 0:
+        return
+    if match.get("status") == GameStatus.PLAYING:
+        turn_timers.schedule(match["id"], turn_deadline(match["game_state"]))
+    else:
+        turn_timers.cancel(match["id"])
+
+def count_turn_timeout(game_state, user_id, timed_out):
+    """Consecutive turns the player let run out, updated when their turn ends"""
+    player = game_state["players"][user_id]
+    player["timeouts"] = player.get("timeouts", 0) + 1 if timed_out else 0
+
+async def expire_turn(match_id):
+    """Play the overdue turn of an absent player, or forfeit the match for them"""
+    async with match_lock(match_id):
+        match = await load_active_game(match_id)
+        if not match or match.get("status") != GameStatus.PLAYING:
+            return
+        game_state = match["game_state"]
+        deadline = turn_deadline(game_state)
+        if deadline > time.time():
+            # The turn changed hands after this deadline was set
+            turn_timers.schedule(match_id, deadline)
+            return
+
+        user_id = game_state["current_turn"]
+        if match_id in bot_turns:
+            # A bot is still searching its move; its fallback lands within the grace
+            turn_timers.schedule(match_id, time.time() + BOT_MOVE_BUDGET + BOT_MOVE_GRACE)
+            return
+        if game_state["players"][user_id].get("timeouts", 0) + 1 >= TURN_TIMEOUT_FORFEIT:
+            await perform_game_action(match, user_id, "forfeit", {}, timed_out=True)
+            return
+        try:
+            if game_state["phase"] == "draw":
+                action = "draw_stock" if game_state["deck"] else "draw_discard"
+                await perform_game_action(match, user_id, action, {}, timed_out=True)
+            card = best_discard(game_state["players"][user_id]["hand"])
+            await perform_game_action(match, user_id, "discard", {"card_id": CARD_IDS[card]}, timed_out=True)
+        except Exception as e:
+            # A turn that cannot be played (e.g. both piles empty) ends the match
+            logger.warning("Forfeiting match %s after a failed timeout turn: %s", match_id, e)
+            await perform_game_action(match, user_id, "forfeit", {}, timed_out=True)
+
+async def turn_timeout_scheduler():
+    """Advance the turn timer wheel every TURN_TIMER_TICK seconds and expire overdue turns"""
+    while True:
+        await asyncio.sleep(TURN_TIMER_TICK)
+        expired = turn_timers.advance(time.time())
+        results = await asyncio.gather(*(expire_turn(match_id) for match_id in expired), return_exceptions=True)
+        for match_id, result in zip(expired, results):
+            if isinstance(result, Exception):
+                logger.error("Turn timeout of match %s failed: %s", match_id, result)
+
+async def load_turn_timeouts():
+    """Schedule every match this worker owns that is still being played, e.g. after a restart"""
+    async for match in db.matches.find({"status": GameStatus.PLAYING}, {"_id": 0, "id": 1}):
+        if key_owner(match["id"]) == WORKER_ID and match["id"] not in turn_timers.due_ticks:
+            turn_timers.schedule(match["id"], turn_clock_started_at + TURN_TIMEOUT_SECONDS)
+
+# Bots
+# Ids of the bot accounts, searches in flight by match id, and the process pool
+# searching them (started with the first bot move)
+bot_user_ids = set()
+bot_turns = {}
+bot_executor = None
+
+def bot_rollout(hand, unseen_cards, draws, rng):
+    """Unmelded points left after drawing unseen cards at random and discarding greedily"""
+    for card in rng.sample(unseen_cards, min(draws, len(unseen_cards))):
+        hand |= 1 << card
+        hand &= ~(1 << best_discard(hand))
+    return solve_melds(hand)[0]
+
+def choose_bot_move(hand, unseen, phase, discard_top, stock_count, budget, seed):
+    """Pick a bot's next action by Monte Carlo search; runs in the bot process pool.
+
+    Each candidate move leaves a 7-card hand that is played on with random
+    draws of unseen cards. Rollouts go round-robin over the candidates until
+    the budget is spent, and the lowest mean of unmelded points wins.
+    Returns (action, card), the card being the one to discard.
+    """
+    if solve_melds(hand)[0] <= CLOSE_MAX_POINTS:
+        return "close", None
+    rng = random.Random(seed)
+    unseen_cards = mask_cards(unseen)
+    # (action, card, hand to roll out, draws), with the stock draw still to come
+    candidates = []
+    if phase == "draw":
+        if stock_count:
+            candidates.append(("draw_stock", None, hand, BOT_ROLLOUT_DEPTH + 1))
+        if discard_top is not None:
+            taken = hand | 1 << discard_top
+            candidates.append(("draw_discard", None, taken & ~(1 << best_discard(taken)), BOT_ROLLOUT_DEPTH))
+    else:
+        candidates = [("discard", card, hand & ~(1 << card), BOT_ROLLOUT_DEPTH) for card in mask_cards(hand)]
+
+    totals = [0] * len(candidates)
+    deadline = time.perf_counter() + budget
+    while True:
+        for index, (_, _, start, draws) in enumerate(candidates):
+            totals[index] += bot_rollout(start, unseen_cards, draws, rng)
+        if time.perf_counter() >= deadline:
+            break
+    # Equal scores discard the card worth the most points
+    best = min(range(len(candidates)), key=lambda index: (
+        totals[index], -CARD_POINTS[candidates[index][1]] if candidates[index][1] is not None else 0))
+    return candidates[best][:2]
+
+def get_bot_executor():
+    global bot_executor
+    if bot_executor is None:
+        bot_executor = ProcessPoolExecutor(max_workers=BOT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return bot_executor
+
+def schedule_bot_turn(match):
+    """Start searching a move when a bot holds the turn of a match being played"""
+    if match.get("status") != GameStatus.PLAYING or match["id"] in bot_turns:
+        return
+    if match["game_state"]["current_turn"] in bot_user_ids:
+        bot_turns[match["id"]] = asyncio.create_task(play_bot_turn(match["id"]))
+
+async def play_bot_turn(match_id):
+    """Search a bot's move off the event loop, then play it like any other action"""
+    try:
+        match = active_games.get(match_id)
+        if not match or match.get("status") != GameStatus.PLAYING:
+            return
+        game_state = match["game_state"]
+        bot_id = game_state["current_turn"]
+        seq = match.get("seq", 0)
+        hand = game_state["players"][bot_id]["hand"]
+        discard_pile = game_state["discard_pile"]
+        unseen = ((1 << DECK_SIZE) - 1) & ~hand & ~hand_mask(discard_pile)
+        move = (hand, unseen, game_state["phase"], discard_pile[-1] if discard_pile else None,
+                len(game_state["deck"]), BOT_MOVE_BUDGET, secrets.randbits(32))
+        try:
+            action, card = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(get_bot_executor(), choose_bot_move, *move),
+                BOT_MOVE_BUDGET + BOT_MOVE_GRACE)
+        except Exception as e:
+            # A busy or broken pool must not stall the match: one rollout per candidate
+            logger.warning("Bot search in match %s failed (%r), playing a greedy move", match_id, e)
+            action, card = choose_bot_move(*move[:5], 0, move[6])
+
+        async with match_lock(match_id):
+            match = active_games.get(match_id)
+            if not match or match.get("status") != GameStatus.PLAYING or match.get("seq", 0) != seq:
+                return
+            # The next move of the same bot is scheduled by this one
+            bot_turns.pop(match_id, None)
+            payload = {"card_id": CARD_IDS[card]} if action == "discard" else {}
+            await perform_game_action(match, bot_id, action, payload)
+    except Exception as e:
+        logger.error("Bot move in match %s failed: %s", match_id, e)
+    finally:
+        if bot_turns.get(match_id) is asyncio.current_task():
+            del bot_turns[match_id]
+
+def bot_user_id(index):
+    """Id of the index-th bot account, the same on every worker"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"chinchon-bot-{index}"))
+
+async def ensure_bot_users():
+    """Create the missing bot accounts and load the ids of all of them"""
+    user_ids = [bot_user_id(index) for index in range(BOT_COUNT)]
+    existing = {user["id"] async for user in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1})}
+    for index, user_id in enumerate(user_ids):
+        if user_id in existing:
+            continue
+        # Nobody knows the password, so bot accounts cannot log in
+        password_hash = await run_password_job(hash_password, secrets.token_urlsafe(32))
+        bot = User(id=user_id, username=f"bot_{index + 1}", password_hash=password_hash,
+                   is_bot=True, balance=BOT_BALANCE)
+        try:
+            await db.users.insert_one(bot.dict())
+        except DuplicateKeyError:
+            # Created by another worker, or the username belongs to a player
+            pass
+    bot_user_ids.update({
+        user["id"] async for user in db.users.find({"id": {"$in": user_ids}, "is_bot": True}, {"_id": 0, "id": 1})
+    })
+
+async def top_up_bot(bot_id, stake):
+    """Bring a bot short of the stake back to BOT_BALANCE, recorded as a TOPUP in the ledger.
+    
+    Bots play with house money, which moves like any other balance: an $inc
+    plus its ledger entry. The $inc only applies while the balance is the
+    one read, so concurrent top-ups of a bot move it once.
+    """
+    bot = await db.users.find_one({"id": bot_id}, {"_id": 0, "balance": 1})
+    if not bot or bot["balance"] >= stake:
+        return
+    entry = Transaction(user_id=bot_id, type=TransactionType.TOPUP, amount=BOT_BALANCE - bot["balance"]).dict()
+    query = {"id": bot_id, "balance": bot["balance"]}
+    update = {"$inc": {"balance": entry["amount"]}}
+    try:
+        if MONGO_TRANSACTIONS:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    result = await db.users.update_one(query, update, session=session)
+                    if result.matched_count:
+                        await db.transactions.insert_one(entry, session=session)
+        else:
+            result = await db.users.update_one(query, update)
+            if result.matched_count:
+                await db.transactions.insert_one(entry)
+    finally:
+        await invalidate_user(bot_id)
+
+async def seat_bot(match_id):
+    """Sit a bot in the empty seat of a waiting match"""
+    match = await db.matches.find_one({"id": match_id}, {"_id": 0, "players": 1, "stake_amount": 1})
+    if not match:
+        raise HTTPException(status_code=404, detail="Match not found")
+    candidates = [user_id for user_id in bot_user_ids if user_id not in match["players"]]
+    if not candidates:
+        raise HTTPException(status_code=400, detail="No bot available")
+    bot_id = random.choice(candidates)
+    await top_up_bot(bot_id, match["stake_amount"])
+    bot = User(**await db.users.find_one({"id": bot_id}, {"_id": 0}))
+    return await seat_player(match_id, bot)
+
+async def bot_table_filler():
+    """Seat bots at the tables this worker owns that waited BOT_FILL_AFTER_SECONDS"""
+    while True:
+        await asyncio.sleep(min(BOT_FILL_AFTER_SECONDS, 5))
+        cutoff = datetime.utcnow() - timedelta(seconds=BOT_FILL_AFTER_SECONDS)
+        for summary in list(lobby_matches.values()):
+            if summary["created_at"] > cutoff or len(summary["players"]) != 1 or key_owner(summary["id"]) != WORKER_ID:
+                continue
+            try:
+                await seat_bot(summary["id"])
+            except HTTPException as e:
+                logger.info("No bot seated in match %s: %s", summary["id"], e.detail)
+
+# Lobby index
+def lobby_summary(match):
+    """Lobby projection of a match document or model dict"""
+    return {field: match.get(field) for field in LOBBY_FIELDS}
+
+def parse_lobby_cursor(cursor):
+    """Decode a "<created_at>|<id>" pagination cursor into a sort key"""
+    created_at, _, match_id = cursor.partition("|")
+    try:
+        return datetime.fromisoformat(created_at), match_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def lobby_cursor(summary):
+    return f"{summary['created_at'].isoformat()}|{summary['id']}"
+
+def lobby_page(cursor=None, limit=LOBBY_PAGE_SIZE):
+    """Newest-first page of waiting matches older than the cursor, plus the next cursor"""
+    end = bisect_left(lobby_keys, parse_lobby_cursor(cursor)) if cursor else len(lobby_keys)
+    keys = lobby_keys[max(0, end - limit):end][::-1]
+    page = [lobby_matches[match_id] for _, match_id in keys]
+    next_cursor = lobby_cursor(page[-1]) if page and end > limit else None
+    return page, next_cursor
+
+def index_lobby_match(summary):
+    if summary["id"] not in lobby_matches:
+        insort(lobby_keys, (summary["created_at"], summary["id"]))
+    lobby_matches[summary["id"]] = summary
+
+def unindex_lobby_match(match_id):
+    summary = lobby_matches.pop(match_id, None)
+    if summary is not None:
+        del lobby_keys[bisect_left(lobby_keys, (summary["created_at"], match_id))]
+    return summary
+
+async def lobby_add(match):
+    """Insert or refresh a waiting match in the lobby and push it to subscribers"""
+    summary = lobby_summary(match)
+    index_lobby_match(summary)
+    await publish_worker_event("lobby_add", summary)
+    await emit_event("lobby_add", summary, room="lobby")
+
+async def lobby_remove(match_id):
+    """Drop a match that stopped waiting from the lobby and tell subscribers"""
+    if unindex_lobby_match(match_id) is None:
+        return
+    await publish_worker_event("lobby_remove", match_id)
+    await emit_event("lobby_remove", {"id": match_id}, room="lobby")
+
+async def load_lobby_index():
+    """Fill the lobby index with the waiting matches stored in MongoDB"""
+    projection = {field: 1 for field in LOBBY_FIELDS}
+    projection["_id"] = 0
+    matches = await db.matches.find({"status": GameStatus.WAITING}, projection).to_list(None)
+    for match in matches:
+        lobby_matches[match["id"]] = lobby_summary(match)
+    lobby_keys[:] = sorted((match["created_at"], match["id"]) for match in matches)
+
+# Matchmaking
+def stake_levels(min_stake, max_stake):
+    """Stake levels (multiples of MATCHMAKING_STAKE_STEP) inside [min_stake, max_stake]"""
+    first = max(1, math.ceil(min_stake / MATCHMAKING_STAKE_STEP - 1e-9))
+    last = math.floor(max_stake / MATCHMAKING_STAKE_STEP + 1e-9)
+    return list(range(first, last + 1))
+
+def find_matchmaking_partner(target_points, levels):
+    """Pop the longest-waiting active ticket on the lowest shared stake level"""
+    now = time.monotonic()
+    for level in levels:
+        queue = matchmaking_queues.get((target_points, level))
+        while queue:
+            ticket = queue.popleft()
+            if ticket["active"] and ticket["expires_at"] <= now:
+                # Its player stopped polling and is likely gone
+                cancel_ticket(ticket["user_id"])
+            if ticket["active"]:
+                if not queue:
+                    del matchmaking_queues[(target_points, level)]
+                return ticket, level
+        matchmaking_queues.pop((target_points, level), None)
+    return None, None
+
+def enqueue_ticket(ticket):
+    ticket["active"] = True
+    ticket["expires_at"] = time.monotonic() + MATCHMAKING_TICKET_TTL
+    matchmaking_tickets[ticket["user_id"]] = ticket
+    for level in ticket["levels"]:
+        matchmaking_queues.setdefault((ticket["target_points"], level), deque()).append(ticket)
+
+def cancel_ticket(user_id):
+    ticket = matchmaking_tickets.pop(user_id, None)
+    if ticket:
+        # Deactivated in place; queues drop inactive tickets once at the front
+        ticket["active"] = False
+        for level in ticket["levels"]:
+            key = (ticket["target_points"], level)
+            queue = matchmaking_queues.get(key)
+            while queue and not queue[0]["active"]:
+                queue.popleft()
+            if not queue:
+                matchmaking_queues.pop(key, None)
+    return ticket
+
+async def user_balance(user_id):
+    """Current balance of a user, read from MongoDB rather than the user cache"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "balance": 1})
+    return user["balance"] if user else 0
+
+async def start_matched_game(player_ids, target_points, stake_amount):
+    """Create a match for two paired players and deal it straight away"""
+    match_obj = Match(
+        host_id=player_ids[0],
+        target_points=target_points,
+        stake_amount=stake_amount,
+        status=GameStatus.PLAYING,
+        players=list(player_ids)
+    )
+    seed = new_deal_seed()
+    game_state = deal_game(match_obj.players, seed)
+    match_obj.game_state = encode_game_state(game_state)
+    await db.matches.insert_one(match_obj.dict())
+    # Logged only once the match exists, so a failed insert leaves no deal behind
+    record_deal(match_obj.id, match_obj.players, seed, game_state)
+    if key_owner(match_obj.id) == WORKER_ID:
+        active_games[match_obj.id] = {**match_obj.dict(), "game_state": game_state}
+        schedule_turn_timeout(active_games[match_obj.id])
+        schedule_bot_turn(active_games[match_obj.id])
+    else:
+        # The owning worker loads the match, which starts its turn timer and bot turns
+        await publish_worker_event("match_started", match_obj.id)
+    for player_id in player_ids:
+        matchmaking_results.set(player_id, match_obj.id)
+    return match_obj
+
+# Worker routing
+# Sessions of sockets connected to other workers, as sent with their forwarded events
+remote_sessions = {}
+
+# Headers passed through when a request is proxied to the owning worker
+FORWARDED_HEADERS = {"authorization", "content-type", "x-next-cursor"}
+worker_client = httpx.AsyncClient(timeout=10.0)
+
+async def publish_worker_event(name, data):
+    """Tell the other workers about a change to state they each keep a copy of"""
+    if isinstance(sio.manager, WorkerEventsMixin):
+        await sio.manager.publish_worker_event(name, data)
+
+async def handle_worker_event(name, data):
+    """Apply an event published by another worker"""
+    if name == "lobby_add":
+        index_lobby_match({**data, "created_at": datetime.fromisoformat(data["created_at"])})
+    elif name == "lobby_remove":
+        unindex_lobby_match(data)
+    elif name == "invalidate_user":
+        user_cache.pop(data)
+    elif name == "socket_disconnected":
+        untrack_player_sid(data)
+        binary_sids.discard(data)
+        remote_sessions.pop(data, None)
+    elif name == "match_started" and key_owner(data) == WORKER_ID:
+        await load_active_game(data)
+    elif name == "matchmaking_cancel" and key_owner("matchmaking") == WORKER_ID:
+        cancel_ticket(data)
+    elif name == "socket_event" and data["worker"] == WORKER_ID:
+        if data["binary"]:
+            binary_sids.add(data["sid"])
+        remote_sessions[data["sid"]] = data["session"]
+        sio.start_background_task(MATCH_SOCKET_EVENTS[data["event"]], data["sid"], data["data"])
+
+async def forward_socket_event(sid, event, data, session):
+    """Hand a match event and the socket's session to the worker owning the match; False when it is this one"""
+    owner = key_owner(data.get("match_id") or "")
+    if owner == WORKER_ID:
+        return False
+    await publish_worker_event("socket_event", {
+        "worker": owner, "event": event, "sid": sid, "binary": sid in binary_sids, "data": data, "session": session
+    })
+    return True
+
+async def socket_session(sid):
+    """Identity and current match of a socket, whichever worker holds its connection"""
+    session = remote_sessions.get(sid)
+    if session is None:
+        try:
+            session = await sio.get_session(sid)
+        except KeyError:
+            # Disconnected meanwhile
+            return None
+    return session
+
+async def socket_match_event(sid, event, data):
+    """(session, match_id) of a match event this worker should handle, else None.
+    
+    The match defaults to the socket's current one. Events for a match owned by
+    another worker are forwarded there together with the session.
+    """
+    session = await socket_session(sid)
+    match_id = (data or {}).get("match_id") or (session or {}).get("match_id")
+    if session is None or not match_id:
+        return None
+    if await forward_socket_event(sid, event, {**(data or {}), "match_id": match_id}, session):
+        return None
+    return session, match_id
+
+async def proxy_to_owner(request: Request, key):
+    """Forward a request about a key owned by another worker; None when it is this one"""
+    owner = key_owner(key)
+    if owner == WORKER_ID:
+        return None
+    if owner >= len(WORKER_URLS):
+        raise HTTPException(status_code=503, detail="Owning worker is not reachable")
+    response = await worker_client.request(
+        request.method,
+        WORKER_URLS[owner] + request.url.path,
+        params=request.query_params,
+        headers={name: value for name, value in request.headers.items() if name in FORWARDED_HEADERS},
+        content=await request.body()
+    )
+    return Response(
+        response.content,
+        status_code=response.status_code,
+        headers={name: value for name, value in response.headers.items() if name in FORWARDED_HEADERS}
+    )
 
 # API Routes
 @app.post("/api/auth/register", response_model=Token)
@@ -313,14 +2155,18 @@ async def register(user: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = hash_password(user.password)
+    hashed_password = await run_password_job(hash_password, user.password)
     new_user = User(
         username=user.username,
         password_hash=hashed_password,
         avatar=user.avatar
     )
     
-    await db.users.insert_one(new_user.dict())
+    try:
+        await db.users.insert_one(new_user.dict())
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration (username_unique index)
+        raise HTTPException(status_code=400, detail="Username already registered")
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -331,7 +2177,7 @@ async def register(user: UserCreate):
 @app.post("/api/auth/login", response_model=Token)
 async def login(user: UserLogin):
     db_user = await db.users.find_one({"username": user.username})
-    if not db_user or not verify_password(user.password, db_user["password_hash"]):
+    if not db_user or not await run_password_job(verify_password, user.password, db_user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -374,210 +2220,680 @@ async def create_match(match_data: MatchCreate, current_user: User = Depends(get
     )
     
     await db.matches.insert_one(new_match.dict())
+    await lobby_add(new_match.dict())
     return new_match
 
 @app.get("/api/matches")
-async def get_matches(status: Optional[GameStatus] = None):
-    query = {}
-    if status:
-        query["status"] = status
-    
-    matches = await db.matches.find(query).sort("created_at", -1).to_list(100)
-    return [Match(**match) for match in matches]
+async def get_matches(status: Optional[GameStatus] = None, cursor: Optional[str] = None, limit: int = LOBBY_PAGE_SIZE):
+    """Newest-first matches; the cursor for the next page is in the X-Next-Cursor header"""
+    limit = max(1, min(limit, LOBBY_PAGE_SIZE))
+    if status == GameStatus.WAITING:
+        matches, next_cursor = lobby_page(cursor, limit)
+    else:
+        query = {}
+        if status:
+            query["status"] = status
+        if cursor:
+            created_at, match_id = parse_lobby_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": match_id}}
+            ]
+        projection = {field: 1 for field in LOBBY_FIELDS}
+        projection["_id"] = 0
+        matches = await db.matches.find(query, projection).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit).to_list(limit)
+        next_cursor = lobby_cursor(matches[-1]) if len(matches) == limit else None
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return FastJSONResponse(matches, headers=headers)
 
 @app.get("/api/matches/{match_id}")
-async def get_match(match_id: str):
-    match = await db.matches.find_one({"id": match_id})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match not found")
-    return Match(**match)
+async def get_match(match_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
+    match = active_games.get(match_id)
+    if match is None:
+        match = await db.matches.find_one({"id": match_id}, {"_id": 0})
+        if not match:
+            raise HTTPException(status_code=404, detail="Match not found")
+        match["game_state"] = decode_game_state(match.get("game_state"))
+    return FastJSONResponse(match_view(match, current_user.id))
 
 @app.post("/api/matches/{match_id}/join")
-async def join_match(match_id: str, current_user: User = Depends(get_current_user)):
-    match = await db.matches.find_one({"id": match_id})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match not found")
-    
-    match_obj = Match(**match)
-    
-    if match_obj.status != GameStatus.WAITING:
-        raise HTTPException(status_code=400, detail="Match is not waiting for players")
+async def join_match(match_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
     
-    if current_user.id in match_obj.players:
-        raise HTTPException(status_code=400, detail="Already in match")
-    
-    if len(match_obj.players) >= 2:
-        raise HTTPException(status_code=400, detail="Match is full")
-    
-    if current_user.balance < match_obj.stake_amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
+    match = await seat_player(match_id, current_user)
+    return {"message": "Joined match successfully", "match": match_view(match, current_user.id)}
+
+async def seat_player(match_id, current_user):
+    """Add a player to a waiting match, dealing it once both seats are taken.
     
-    # Add player and start game if we have 2 players
-    match_obj.players.append(current_user.id)
-    if len(match_obj.players) == 2:
-        match_obj.status = GameStatus.PLAYING
+    Returns the match, with its in-memory game state once it is dealt.
+    """
+    async with match_lock(match_id):
+        match = await db.matches.find_one({"id": match_id})
+        if not match:
+            raise HTTPException(status_code=404, detail="Match not found")
         
-        # Initialize game state
-        deck = create_spanish_deck()
-        random.shuffle(deck)
+        match_obj = Match(**match)
         
-        # Deal 7 cards to each player
-        player1_hand = deck[:7]
-        player2_hand = deck[7:14]
-        discard_pile = [deck[14]]
-        stock_pile = deck[15:]
+        if match_obj.status != GameStatus.WAITING:
+            raise HTTPException(status_code=400, detail="Match is not waiting for players")
         
-        match_obj.game_state = {
-            "deck": stock_pile,
-            "discard_pile": discard_pile,
-            "players": {
-                match_obj.players[0]: {
-                    "hand": player1_hand,
-                    "points": 0,
-                    "ready": False
-                },
-                match_obj.players[1]: {
-                    "hand": player2_hand,
-                    "points": 0,
-                    "ready": False
-                }
-            },
-            "current_turn": match_obj.players[0],
-            "turn_start_time": datetime.utcnow().isoformat(),
-            "turn_action_taken": False,
-            "phase": "draw"  # draw, discard, or close
-        }
+        if current_user.id in match_obj.players:
+            raise HTTPException(status_code=400, detail="Already in match")
+        
+        if len(match_obj.players) >= 2:
+            raise HTTPException(status_code=400, detail="Match is full")
+        
+        if current_user.balance < match_obj.stake_amount:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
         
-        # Store in active games
-        active_games[match_id] = match_obj.game_state
+        # Add player and start game if we have 2 players
+        match_obj.players.append(current_user.id)
+        if len(match_obj.players) == 2:
+            match_obj.status = GameStatus.PLAYING
+            seed = new_deal_seed()
+            game_state = deal_game(match_obj.players, seed)
+            match_obj.game_state = encode_game_state(game_state)
+            
+        # Compare-and-set: a concurrent writer leaves the stored version changed
+        version = match_obj.version
+        match_obj.version = version + 1
+        result = await db.matches.update_one(
+            version_filter(match_id, version),
+            {"$set": match_obj.dict()}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=409, detail="Match changed while joining, try again")
+        
+        if match_obj.status == GameStatus.PLAYING:
+            # Only the deal that was stored is logged; a lost race leaves no event
+            record_deal(match_id, match_obj.players, seed, game_state)
+            # From here on the in-memory copy is authoritative
+            match = active_games.setdefault(match_id, {**match_obj.dict(), "game_state": game_state})
+            schedule_turn_timeout(match)
+            schedule_bot_turn(match)
+            await lobby_remove(match_id)
+            return match
+        await lobby_add(match_obj.dict())
+        return match_obj.dict()
+
+@app.post("/api/matchmaking")
+async def enqueue_matchmaking(request: MatchmakingRequest, http_request: Request,
+                              current_user: User = Depends(get_current_user)):
+    """Pair with a queued player on a shared stake level, or wait in the queue"""
+    # All queues live on the one worker owning the "matchmaking" key
+    forwarded = await proxy_to_owner(http_request, "matchmaking")
+    if forwarded is not None:
+        return forwarded
     
-    await db.matches.update_one(
-        {"id": match_id},
-        {"$set": match_obj.dict()}
-    )
+    if request.min_stake > request.max_stake:
+        raise HTTPException(status_code=400, detail="Invalid stake range")
+    
+    # Balances are read fresh: a cached user may predate a loss
+    balance = await user_balance(current_user.id)
+    levels = [
+        level for level in stake_levels(request.min_stake, request.max_stake)
+        if level * MATCHMAKING_STAKE_STEP <= balance
+    ]
+    if not levels:
+        raise HTTPException(status_code=400, detail="No affordable stake level in range")
+    if len(levels) > MATCHMAKING_MAX_LEVELS:
+        raise HTTPException(status_code=400, detail="Stake range too wide")
     
-    return {"message": "Joined match successfully", "match": match_obj}
+    # A new request replaces any ticket the player already had queued
+    cancel_ticket(current_user.id)
+    matchmaking_results.pop(current_user.id)
+    while True:
+        partner, level = find_matchmaking_partner(request.target_points, levels)
+        if partner is None or await user_balance(partner["user_id"]) >= level * MATCHMAKING_STAKE_STEP:
+            break
+        # The partner can no longer cover the stake they queued for
+        cancel_ticket(partner["user_id"])
+        await emit_event("matchmaking_cancelled", {"reason": "Insufficient balance"},
+                         room=f"user:{partner['user_id']}")
+    if partner is None:
+        enqueue_ticket({
+            "user_id": current_user.id,
+            "target_points": request.target_points,
+            "levels": levels,
+            "queued_at": datetime.utcnow()
+        })
+        return {"status": "queued"}
+    
+    cancel_ticket(partner["user_id"])
+    match_obj = await start_matched_game(
+        [partner["user_id"], current_user.id], request.target_points, level * MATCHMAKING_STAKE_STEP
+    )
+    await emit_event("match_found", {"match_id": match_obj.id}, room=f"user:{partner['user_id']}")
+    return {"status": "matched", "match_id": match_obj.id, "match": lobby_summary(match_obj.dict())}
+
+@app.delete("/api/matchmaking")
+async def cancel_matchmaking(request: Request, current_user: User = Depends(get_current_user)):
+    forwarded = await proxy_to_owner(request, "matchmaking")
+    if forwarded is not None:
+        return forwarded
+    if not cancel_ticket(current_user.id):
+        raise HTTPException(status_code=404, detail="Not in matchmaking queue")
+    return {"status": "cancelled"}
+
+@app.get("/api/matchmaking")
+async def get_matchmaking_status(request: Request, current_user: User = Depends(get_current_user)):
+    forwarded = await proxy_to_owner(request, "matchmaking")
+    if forwarded is not None:
+        return forwarded
+    ticket = matchmaking_tickets.get(current_user.id)
+    if ticket and ticket["expires_at"] <= time.monotonic():
+        cancel_ticket(current_user.id)
+        ticket = None
+    if ticket:
+        ticket["expires_at"] = time.monotonic() + MATCHMAKING_TICKET_TTL
+        return {"status": "queued", "target_points": ticket["target_points"],
+                "stakes": [level * MATCHMAKING_STAKE_STEP for level in ticket["levels"]],
+                "queued_at": ticket["queued_at"]}
+    match_id = matchmaking_results.get(current_user.id)
+    if match_id:
+        return {"status": "matched", "match_id": match_id}
+    return {"status": "idle"}
+
+@app.get("/api/admin/indexes")
+async def get_index_report(current_user: User = Depends(get_current_user)):
+    """Index usage per collection, declared indexes missing from MongoDB and recent slow queries"""
+    require_admin(current_user)
+    collections = {}
+    for collection, indexes in COLLECTION_INDEXES.items():
+        stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        usage = {index["name"]: index["accesses"]["ops"] for index in stats}
+        collections[collection] = {
+            "usage": usage,
+            "missing": [index.document["name"] for index in indexes if index.document["name"] not in usage]
+        }
+    return FastJSONResponse({"collections": collections, "slow_queries": list(slow_queries)})
+
+@app.get("/api/admin/matches/{match_id}/events")
+async def get_match_events(match_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Audit trail of a match: its deal seed and every action"""
+    require_admin(current_user)
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
+    await flush_match_events()
+    events = await db.match_events.find({"match_id": match_id}, {"_id": 0}).sort("seq", 1).to_list(None)
+    return FastJSONResponse(events)
+
+@app.get("/api/admin/matches/{match_id}/replay")
+async def get_match_replay(match_id: str, request: Request, seq: Optional[int] = None,
+                           current_user: User = Depends(get_current_user)):
+    """Full state of a match after event seq (default: the last), rebuilt from the log"""
+    require_admin(current_user)
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
+    await flush_match_events()
+    match = await replay_match(match_id, seq)
+    if match["seq"] < 0:
+        raise HTTPException(status_code=404, detail="No events for match")
+    return FastJSONResponse(match_document(match))
+
+@app.post("/api/admin/matches/{match_id}/bot")
+async def add_match_bot(match_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Sit a bot opponent in a waiting match"""
+    require_admin(current_user)
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
+    match = await seat_bot(match_id)
+    return {"message": "Bot joined match", "match": match_view(match, current_user.id)}
+
+@app.get("/api/admin/cache")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    require_admin(current_user)
+    return {"users": user_cache.info(), "tokens": token_cache.info(), "chat": chat_buffers.info()}
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """This worker's metrics in the Prometheus text format"""
+    namespace_rooms = sio.manager.rooms.get("/", {})
+    sids = namespace_rooms.get(None, {})
+    rooms = sum(1 for room in namespace_rooms if room is not None and room not in sids)
+    meld_cache = solve_melds.cache_info()
+    caches = {"users": user_cache.info(), "tokens": token_cache.info(),
+              "melds": {"size": meld_cache.currsize, "hits": meld_cache.hits, "misses": meld_cache.misses}}
+    gauges = [
+        ("socketio_connected_sids", "Sockets connected to this worker", len(sids)),
+        ("socketio_rooms", "Socket.IO rooms with members on this worker, excluding per-socket rooms", rooms),
+        ("active_games", "Matches held in memory by this worker", len(active_games)),
+        ("dirty_games", "Matches waiting for the write-behind flush", len(dirty_games)),
+        ("pending_match_events", "Match events waiting to be appended to the log", len(pending_match_events)),
+        ("pending_chat_messages", "Chat messages waiting to be inserted", len(pending_chat_messages)),
+        ("lobby_matches", "Waiting matches in the lobby index", len(lobby_matches)),
+        ("matchmaking_tickets", "Users waiting in the matchmaking queues", len(matchmaking_tickets)),
+        ("turn_timers", "Turn deadlines on the timer wheel", len(turn_timers)),
+        ("bot_searches", "Bot moves being searched", len(bot_turns)),
+        ("password_hash_jobs", "bcrypt jobs queued or running", password_jobs),
+        ("event_loop_lag_seconds", "Event loop lag at the latest probe", loop_lag["last"]),
+        ("event_loop_lag_max_seconds", "Largest event loop lag since startup", loop_lag["max"]),
+    ]
+    lines = []
+    for name, description, value in gauges:
+        lines += render_metric(name, description, "gauge", [({}, value)])
+    lines += render_metric("cache_entries", "Entries held per cache", "gauge",
+                           [({"cache": name}, info["size"]) for name, info in caches.items()])
+    lines += render_metric("cache_hits_total", "Cache lookups answered from memory", "counter",
+                           [({"cache": name}, info["hits"]) for name, info in caches.items()])
+    lines += render_metric("cache_misses_total", "Cache lookups that missed", "counter",
+                           [({"cache": name}, info["misses"]) for name, info in caches.items()])
+    for histogram in (socket_event_latency, http_request_latency, mongo_command_latency):
+        lines += histogram.render()
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/api/matches/{match_id}/rounds")
+async def get_match_rounds(match_id: str, request: Request):
+    """Summaries of the finished rounds of a match, oldest first"""
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
+    await flush_match_events()
+    rounds = await db.match_rounds.find({"match_id": match_id}, {"_id": 0}).sort("round", 1).to_list(None)
+    return FastJSONResponse(rounds)
 
 @app.get("/api/matches/{match_id}/chat")
-async def get_match_chat(match_id: str):
-    messages = await db.chat_messages.find(
-        {"match_id": match_id}
-    ).sort("created_at", 1).limit(50).to_list(50)
-    return [ChatMessage(**msg) for msg in messages]
+async def get_match_chat(match_id: str, request: Request):
+    forwarded = await proxy_to_owner(request, match_id)
+    if forwarded is not None:
+        return forwarded
+    return FastJSONResponse(list(await load_chat_buffer(match_id) or ()))
+
+# Per-player state broadcasts
+def track_player_sid(match_id, user_id, sid):
+    """Remember which player a socket in a match room belongs to"""
+    match_player_sids.setdefault(match_id, {}).setdefault(user_id, set()).add(sid)
+    sid_matches.setdefault(sid, {})[match_id] = user_id
+
+def untrack_player_sid(sid, match_id=None):
+    """Forget a socket for one match, or for all of them when match_id is None"""
+    matches = sid_matches.get(sid, {})
+    for room_id in ([match_id] if match_id else list(matches)):
+        user_id = matches.pop(room_id, None)
+        players = match_player_sids.get(room_id, {})
+        players.get(user_id, set()).discard(sid)
+        if user_id in players and not players[user_id]:
+            del players[user_id]
+        if room_id in match_player_sids and not players:
+            del match_player_sids[room_id]
+    if not matches:
+        sid_matches.pop(sid, None)
+
+def pile_state(game_state):
+    """Public summary of the stock and discard piles"""
+    discard_pile = game_state["discard_pile"]
+    return {
+        "deck_count": len(game_state["deck"]),
+        "discard_count": len(discard_pile),
+        "discard_top": CARD_DICTS[discard_pile[-1]] if discard_pile else None
+    }
+
+def player_view(match, viewer_id):
+    """Redacted game state of a match as seen by one player.
+    
+    Only the viewer's own hand is included until the match is finished; the
+    piles and the other hands are reduced to counts and the top discard, and
+    only the viewer gets the hint of their own hand.
+    """
+    game_state = match.get("game_state")
+    if not game_state:
+        return {}
+    reveal_all = match.get("status") == GameStatus.FINISHED
+    view = {key: value for key, value in game_state.items() if key not in ("deck", "discard_pile", "players")}
+    view.update(pile_state(game_state))
+    view["players"] = {}
+    for player_id, player in game_state["players"].items():
+        entry = {key: value for key, value in player.items() if key not in ("hand", "eval")}
+        entry["hand_count"] = card_count(player["hand"])
+        if reveal_all or player_id == viewer_id:
+            entry["hand"] = mask_to_dicts(player["hand"])
+        if player_id == viewer_id:
+            entry["hint"] = hand_hint(player)
+        view["players"][player_id] = entry
+    return view
+
+def match_view(match, viewer_id):
+    """A match as returned to one user over REST, its game state redacted by player_view"""
+    return {**match, "game_state": player_view(match, viewer_id)}
+
+def match_snapshot(match, viewer_id):
+    """Full match_state payload for one player; deltas continue from its seq"""
+    return {
+        "match_id": match["id"],
+        "seq": match.get("seq", 0),
+        "state": player_view(match, viewer_id),
+        "status": match.get("status"),
+        "players": match.get("players", [])
+    }
+
+def codec_room(sid, room):
+    """Room a socket actually joins: msgpack sockets join the room's #msgpack twin"""
+    return f"{room}#msgpack" if sid in binary_sids else room
+
+async def emit_event(event, data, room, skip_sid=None):
+    """Emit to a room or a single sid, msgpack-encoding the payload for binary-mode sockets"""
+    if room in binary_sids:
+        await sio.emit(event, pack_payload(data), room=room)
+        return
+    await sio.emit(event, data, room=room, skip_sid=skip_sid)
+    if room in sid_matches or sio.manager.is_connected(room, '/'):
+        return
+    # Twin rooms may have members on other workers, so always publish there
+    twin = f"{room}#msgpack"
+    if WORKER_COUNT > 1 or sio.manager.rooms.get('/', {}).get(twin):
+        await sio.emit(event, pack_payload(data), room=twin, skip_sid=skip_sid)
+
+async def broadcast_delta(match_id, delta, actor_id, private=None):
+    """Send a match_delta to the room; private fields only reach the acting player"""
+    if match_id in active_games:
+        buffer = match_deltas.get(match_id)
+        if buffer is None:
+            buffer = match_deltas[match_id] = deque(maxlen=MATCH_DELTA_BUFFER_SIZE)
+        buffer.append((delta["seq"], delta, actor_id, private))
+    actor_sids = list(match_player_sids.get(match_id, {}).get(actor_id, ()))
+    if not private or not actor_sids:
+        await emit_event("match_delta", delta, room=match_id)
+        return
+    for sid in actor_sids:
+        await emit_event("match_delta", {**delta, **private}, room=sid)
+    await emit_event("match_delta", delta, room=match_id, skip_sid=actor_sids)
+
+def missed_deltas(match, last_seq, viewer_id):
+    """Deltas after last_seq as the viewer received them, or None if the buffer no longer covers the gap"""
+    seq = match.get("seq", 0)
+    if last_seq > seq:
+        return None
+    deltas = [
+        {**delta, **private} if private and actor_id == viewer_id else delta
+        for delta_seq, delta, actor_id, private in match_deltas.get(match["id"], ())
+        if delta_seq > last_seq
+    ]
+    # A round's deal is not a delta, so a gap spanning one is never covered
+    if len(deltas) != seq - last_seq or (deltas and deltas[0]["seq"] != last_seq + 1):
+        return None
+    return deltas
+
+async def send_match_states(match):
+    """Send each player watching a match their own match_state, e.g. after a new deal"""
+    for user_id, sids in match_player_sids.get(match["id"], {}).items():
+        snapshot = match_snapshot(match, user_id)
+        for sid in list(sids):
+            await emit_event("match_state", snapshot, room=sid)
 
 # Socket.IO Events
 @sio.event
-async def connect(sid, environ):
+@timed_event
+async def connect(sid, environ, auth=None):
+    auth = auth if isinstance(auth, dict) else {}
+    query = parse_qs(environ.get("QUERY_STRING", ""))
+    # The JWT comes in auth={"token": ...}, ?token= or an Authorization header and is
+    # verified once here; events then take the user from the session
+    token = auth.get("token") or query.get("token", [None])[0]
+    authorization = environ.get("HTTP_AUTHORIZATION", "")
+    if not token and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+    user = await user_from_token(token) if token else None
+    if user is None:
+        raise socketio.exceptions.ConnectionRefusedError("Could not validate credentials")
+    
+    # Clients opt into msgpack payloads with ?codec=msgpack or auth={"codec": "msgpack"}
+    codec = auth.get("codec") or query.get("codec", [None])[0]
+    if codec == "msgpack":
+        binary_sids.add(sid)
+    await sio.save_session(sid, {"user_id": user.id, "username": user.username, "match_id": None})
+    # Per-user room for match_found notifications
+    await sio.enter_room(sid, codec_room(sid, f"user:{user.id}"))
     print(f"Client {sid} connected")
 
 @sio.event
+@timed_event
 async def disconnect(sid):
+    session = await socket_session(sid)
+    untrack_player_sid(sid)
+    binary_sids.discard(sid)
+    await publish_worker_event("socket_disconnected", sid)
+    if session:
+        # A player who left must not be seated in a match later
+        if key_owner("matchmaking") == WORKER_ID:
+            cancel_ticket(session["user_id"])
+        else:
+            await publish_worker_event("matchmaking_cancel", session["user_id"])
     print(f"Client {sid} disconnected")
 
 @sio.event
+@timed_event
 async def join_match_room(sid, data):
-    match_id = data.get("match_id")
-    user_id = data.get("user_id")
+    session = await socket_session(sid)
+    if session and data.get("match_id") and sid not in remote_sessions:
+        # The connection's worker remembers the current match for later events
+        session["match_id"] = data["match_id"]
+        await sio.save_session(sid, session)
+    routed = await socket_match_event(sid, "join_match_room", data)
+    if routed is None:
+        return
+    session, match_id = routed
+    user_id = session["user_id"]
     
     if match_id and user_id:
-        await sio.enter_room(sid, match_id)
+        await sio.enter_room(sid, codec_room(sid, match_id))
+        track_player_sid(match_id, user_id, sid)
         
-        # Get current match state
-        match = await db.matches.find_one({"id": match_id})
-        if match:
-            await sio.emit("match_state", {
-                "match_id": match_id,
-                "state": match.get("game_state", {}),
-                "status": match.get("status"),
-                "players": match.get("players", [])
-            }, room=sid)
+        # A match being played is served from memory; only others are read from MongoDB
+        match = await load_active_game(match_id)
+        if match is None:
+            match = await db.matches.find_one({"id": match_id}, {"_id": 0})
+            if match:
+                match["game_state"] = decode_game_state(match.get("game_state"))
+        
+        # A resuming client gets the deltas it missed rather than the whole state
+        last_seq = data.get("last_seq")
+        missed = None
+        if match and isinstance(last_seq, int) and match.get("status") == GameStatus.PLAYING:
+            missed = missed_deltas(match, last_seq, user_id)
+        if missed is not None:
+            for delta in missed:
+                await emit_event("match_delta", delta, room=sid)
+        elif match:
+            await emit_event("match_state", match_snapshot(match, user_id), room=sid)
         
-        await sio.emit("joined_room", {"match_id": match_id}, room=sid)
+        await emit_event("joined_room", {"match_id": match_id, "resumed": missed is not None}, room=sid)
 
 @sio.event
+@timed_event
 async def leave_match_room(sid, data):
-    match_id = data.get("match_id")
+    session = await socket_session(sid)
+    if session and sid not in remote_sessions and session["match_id"] == (data or {}).get("match_id", session["match_id"]):
+        session["match_id"] = None
+        await sio.save_session(sid, session)
+    routed = await socket_match_event(sid, "leave_match_room", data)
+    if routed is None:
+        return
+    session, match_id = routed
     if match_id:
-        await sio.leave_room(sid, match_id)
+        await sio.leave_room(sid, codec_room(sid, match_id))
+        untrack_player_sid(sid, match_id)
+
+@sio.event
+@timed_event
+async def subscribe_lobby(sid, data=None):
+    """Join the lobby room for lobby_add/lobby_remove pushes, starting from a snapshot"""
+    await sio.enter_room(sid, codec_room(sid, "lobby"))
+    matches, next_cursor = lobby_page()
+    await emit_event("lobby_snapshot", {"matches": matches, "next_cursor": next_cursor}, room=sid)
+
+@sio.event
+@timed_event
+async def unsubscribe_lobby(sid, data=None):
+    await sio.leave_room(sid, codec_room(sid, "lobby"))
+
+@sio.event
+@timed_event
+async def join_user_room(sid, data):
+    """Join the per-user room used for match_found notifications (already done at connect)"""
+    session = await socket_session(sid)
+    if session:
+        await sio.enter_room(sid, codec_room(sid, f"user:{session['user_id']}"))
 
 @sio.event
+@timed_event
 async def send_chat_message(sid, data):
-    match_id = data.get("match_id")
-    user_id = data.get("user_id")
+    routed = await socket_match_event(sid, "send_chat_message", data)
+    if routed is None:
+        return
+    session, match_id = routed
     content = data.get("content")
     
-    if match_id and user_id and content:
-        user = await db.users.find_one({"id": user_id})
-        if user:
-            message = ChatMessage(
-                match_id=match_id,
-                user_id=user_id,
-                username=user["username"],
-                content=content
-            )
-            
-            await db.chat_messages.insert_one(message.dict())
-            
-            # Keep only last 50 messages
-            message_count = await db.chat_messages.count_documents({"match_id": match_id})
-            if message_count > 50:
-                oldest_messages = await db.chat_messages.find(
-                    {"match_id": match_id}
-                ).sort("created_at", 1).limit(message_count - 50).to_list(None)
-                
-                oldest_ids = [msg["id"] for msg in oldest_messages]
-                await db.chat_messages.delete_many({"id": {"$in": oldest_ids}})
-            
-            await sio.emit("chat_message", message.dict(), room=match_id)
+    if content and await match_exists(match_id):
+        message = ChatMessage(
+            match_id=match_id,
+            user_id=session["user_id"],
+            username=session["username"],
+            content=content
+        ).dict()
+        
+        # The ring buffer keeps the last CHAT_HISTORY_SIZE messages;
+        # MongoDB gets them in batches (insert_many adds _id, so copy)
+        buffer = await load_chat_buffer(match_id, create=True)
+        buffer.append(message)
+        # Each message keeps the buffer from expiring
+        chat_buffers.set(match_id, buffer)
+        pending_chat_messages.append(dict(message))
+        
+        await emit_event("chat_message", message, room=match_id)
 
 @sio.event
+@timed_event
 async def game_action(sid, data):
-    match_id = data.get("match_id")
-    user_id = data.get("user_id")
+    routed = await socket_match_event(sid, "game_action", data)
+    if routed is None:
+        return
+    session, match_id = routed
+    user_id = session["user_id"]
     action = data.get("action")
     payload = data.get("payload", {})
     
-    if not all([match_id, user_id, action]):
-        return
-    
-    # Get match from database
-    match = await db.matches.find_one({"id": match_id})
-    if not match or match.get("status") != "playing":
-        return
-    
-    game_state = match.get("game_state", {})
-    if user_id != game_state.get("current_turn"):
-        await sio.emit("error", {"message": "Not your turn"}, room=sid)
+    if not action:
         return
     
-    # Handle different game actions
-    try:
-        if action == "draw_stock":
-            await handle_draw_stock(match_id, user_id, game_state)
-        elif action == "draw_discard":
-            await handle_draw_discard(match_id, user_id, game_state)
-        elif action == "discard":
-            card_id = payload.get("card_id")
-            await handle_discard(match_id, user_id, card_id, game_state)
-        elif action == "close":
-            await handle_close(match_id, user_id, game_state)
-        
-        # Update match in database
-        await db.matches.update_one(
-            {"id": match_id},
-            {"$set": {"game_state": game_state}}
-        )
+    # One action at a time per match, so awaits inside a handler cannot interleave
+    async with match_lock(match_id):
+        # Turn validation runs against the in-memory state only
+        match = await load_active_game(match_id)
+        if not match or match.get("status") != GameStatus.PLAYING:
+            return
         
-        # Broadcast updated state
-        await sio.emit("match_state", {
-            "match_id": match_id,
-            "state": game_state,
-            "status": match.get("status"),
-            "players": match.get("players", [])
-        }, room=match_id)
+        if user_id != match["game_state"].get("current_turn"):
+            await emit_event("error", {"message": "Not your turn"}, room=sid)
+            return
         
-    except Exception as e:
-        await sio.emit("error", {"message": str(e)}, room=sid)
+        try:
+            if action not in PLAYER_ACTIONS:
+                raise Exception(f"Unknown action: {action}")
+            await perform_game_action(match, user_id, action, payload)
+        except Exception as e:
+            await emit_event("error", {"message": str(e)}, room=sid)
+
+# Actions players may send; the turn clock can also forfeit for them
+PLAYER_ACTIONS = ("draw_stock", "draw_discard", "discard", "close")
+
+async def perform_game_action(match, user_id, action, payload, timed_out=False):
+    """Apply, log and broadcast one action of the player whose turn it is.
+    
+    Callers hold the match lock and have checked the turn.
+    """
+    match_id = match["id"]
+    game_state = match["game_state"]
+    changes = {}
+    private = None
+    card = None
+    if action == "draw_stock":
+        card = await handle_draw_stock(match_id, user_id, game_state)
+        # Only the drawing player may see a card from the stock
+        private = {"card": CARD_DICTS[card]}
+    elif action == "draw_discard":
+        card = await handle_draw_discard(match_id, user_id, game_state)
+        changes["card"] = CARD_DICTS[card]
+    elif action == "discard":
+        card_id = payload.get("card_id")
+        card = await handle_discard(match_id, user_id, card_id, game_state)
+        count_turn_timeout(game_state, user_id, timed_out)
+        changes["card"] = CARD_DICTS[card]
+        changes["turn_start_time"] = game_state["turn_start_time"]
+    elif action == "close":
+        round_result = await handle_close(match_id, user_id, game_state)
+        changes["points"] = round_result["points"][user_id]
+        changes["round_result"] = round_result
+        changes["status"] = match["status"]
+        changes["winner_id"] = match.get("winner_id")
+    elif action == "forfeit":
+        await handle_forfeit(match_id, user_id, game_state)
+        changes["status"] = match["status"]
+        changes["winner_id"] = match.get("winner_id")
+    else:
+        raise Exception(f"Unknown action: {action}")
+    if timed_out:
+        changes["timed_out"] = True
+    # The acting player's own points and whether they may close
+    private = {**(private or {}), "hint": hand_hint(game_state["players"][user_id])}
+    
+    # Logged and persisted asynchronously by the write-behind flusher
+    match["seq"] = match.get("seq", 0) + 1
+    record_match_event(
+        match_id, match["seq"], action,
+        player_id=user_id,
+        card=CARD_IDS[card] if card is not None else None,
+        timed_out=timed_out,
+        created_at=datetime.fromisoformat(game_state["turn_start_time"]) if action == "discard" else datetime.utcnow()
+    )
+    if action == "close":
+        record_round(match_id, match["seq"], round_result)
+    
+    # Broadcast what changed rather than the whole state; built before any
+    # next deal, so a close goes out with its own seq and round state
+    delta = {
+        "match_id": match_id,
+        "seq": match["seq"],
+        "action": action,
+        "player_id": user_id,
+        "hand_count": card_count(game_state["players"][user_id]["hand"]),
+        "current_turn": game_state["current_turn"],
+        "phase": game_state["phase"],
+        **pile_state(game_state),
+        **changes
+    }
+    next_round = action == "close" and match["status"] == GameStatus.PLAYING
+    if next_round:
+        start_next_round(match)
+    mark_game_dirty(match_id)
+    schedule_turn_timeout(match)
+    schedule_bot_turn(match)
+    
+    await broadcast_delta(match_id, delta, user_id, private)
+    if next_round:
+        # Every player gets their new hand, at the deal's seq
+        await send_match_states(match)
+    if match["status"] != GameStatus.PLAYING:
+        # Persist the finished match right away; it is settled once stored
+        await finish_active_game(match_id)
+
+# Match-scoped events, run by the worker owning the match
+MATCH_SOCKET_EVENTS = {
+    "join_match_room": join_match_room,
+    "leave_match_room": leave_match_room,
+    "send_chat_message": send_chat_message,
+    "game_action": game_action,
+}
 
 async def handle_draw_stock(match_id, user_id, game_state):
     """Handle drawing from stock pile"""
@@ -589,11 +2905,14 @@ async def handle_draw_stock(match_id, user_id, game_state):
     
     # Draw card from stock
     card = game_state["deck"].pop(0)
-    game_state["players"][user_id]["hand"].append(card)
+    player = game_state["players"][user_id]
+    player["hand"] |= 1 << card
+    player["eval"] = evaluate_hand(player["hand"])
     
     # Change to discard phase
     game_state["phase"] = "discard"
     game_state["turn_action_taken"] = True
+    return card
 
 async def handle_draw_discard(match_id, user_id, game_state):
     """Handle drawing from discard pile"""
@@ -605,28 +2924,28 @@ async def handle_draw_discard(match_id, user_id, game_state):
     
     # Draw card from discard pile
     card = game_state["discard_pile"].pop()
-    game_state["players"][user_id]["hand"].append(card)
+    player = game_state["players"][user_id]
+    player["hand"] |= 1 << card
+    player["eval"] = evaluate_hand(player["hand"])
     
     # Change to discard phase
     game_state["phase"] = "discard"
     game_state["turn_action_taken"] = True
+    return card
 
 async def handle_discard(match_id, user_id, card_id, game_state):
     """Handle discarding a card"""
     if game_state.get("phase") != "discard":
         raise Exception("Cannot discard in current phase")
     
-    player_hand = game_state["players"][user_id]["hand"]
+    player = game_state["players"][user_id]
     
     # Find and remove the card
-    card_to_discard = None
-    for i, card in enumerate(player_hand):
-        if card.get("id") == card_id:
-            card_to_discard = player_hand.pop(i)
-            break
-    
-    if not card_to_discard:
+    card_to_discard = CARD_INDEX.get(card_id)
+    if card_to_discard is None or not player["hand"] >> card_to_discard & 1:
         raise Exception("Card not found in hand")
+    player["hand"] &= ~(1 << card_to_discard)
+    player["eval"] = evaluate_discard(player.get("eval"), player["hand"], card_to_discard)
     
     # Add to discard pile
     game_state["discard_pile"].append(card_to_discard)
@@ -640,31 +2959,37 @@ async def handle_discard(match_id, user_id, card_id, game_state):
     game_state["phase"] = "draw"
     game_state["turn_action_taken"] = False
     game_state["turn_start_time"] = datetime.utcnow().isoformat()
+    return card_to_discard
 
 async def handle_close(match_id, user_id, game_state):
-    """Handle closing (ending the game)"""
-    player_hand = game_state["players"][user_id]["hand"]
-    
-    # Calculate points for closing player
-    sequences, sets = find_best_melds(player_hand)
-    points = calculate_unmelded_points(player_hand, sequences, sets)
+    """Handle closing (ending the round)"""
+    # Points of the closing player, kept up to date by the draw and discard handlers
+    points = hand_hint(game_state["players"][user_id])["points"]
     
     # Can only close if points <= 7 or perfect chinchón (0 points)
-    if points > 7:
-        raise Exception(f"Cannot close with {points} points (max 7)")
+    if points > CLOSE_MAX_POINTS:
+        raise Exception(f"Cannot close with {points} points (max {CLOSE_MAX_POINTS})")
     
-    # Update match to finished
-    await db.matches.update_one(
-        {"id": match_id},
-        {"$set": {"status": "finished", "winner_id": user_id}}
-    )
-    
-    # Calculate final scores and settle
-    await settle_match(match_id, user_id, points == 0)
+    # Score the round; perform_game_action logs it and deals the next one or settles
+    return close_round(active_games[match_id], user_id)
+
+async def handle_forfeit(match_id, user_id, game_state):
+    """Handle a player forfeiting the match; the opponent wins it"""
+    match = active_games[match_id]
+    match["status"] = GameStatus.FINISHED
+    match["winner_id"] = next(player_id for player_id in game_state["players"] if player_id != user_id)
 
-async def settle_match(match_id, winner_id, perfect_chinchon=False):
-    """Settle the match financially"""
-    match = await db.matches.find_one({"id": match_id})
+async def settle_match(match_id, winner_id, perfect_chinchon=False, match=None):
+    """Settle the match financially.
+    
+    Ledger records get ids derived from the match id, so a second settlement
+    of the same match fails on the unique index and changes nothing.
+    Balances move with atomic $inc in a single bulk write; each user keeps
+    the ids of their recently settled matches, so a retry that finds the
+    ledger already written still moves a balance exactly once.
+    """
+    if match is None:
+        match = await db.matches.find_one({"id": match_id}, {"_id": 0, "players": 1, "stake_amount": 1})
     if not match:
         return
     
@@ -674,30 +2999,93 @@ async def settle_match(match_id, winner_id, perfect_chinchon=False):
     commission = total_pot * commission_rate
     winner_payout = total_pot - commission
     
-    # Update balances
+    ledger = [Transaction(
+        id=f"{match_id}:{TransactionType.COMMISSION.value}",
+        match_id=match_id,
+        type=TransactionType.COMMISSION,
+        amount=commission
+    ).dict()]
+    balance_updates = []
     for player_id in match.get("players", []):
-        user = await db.users.find_one({"id": player_id})
-        if user:
-            if player_id == winner_id:
-                # Winner gets pot minus commission
-                new_balance = user["balance"] + winner_payout - stake
-                await db.users.update_one(
-                    {"id": player_id},
-                    {"$set": {"balance": new_balance}, "$inc": {"stats.wins": 1, "stats.total_won": winner_payout}}
-                )
-            else:
-                # Loser loses their stake
-                new_balance = user["balance"] - stake
-                await db.users.update_one(
-                    {"id": player_id},
-                    {"$set": {"balance": new_balance}, "$inc": {"stats.losses": 1}}
-                )
-            
-            # Update matches played
-            await db.users.update_one(
-                {"id": player_id},
-                {"$inc": {"stats.matches_played": 1}}
-            )
+        if player_id == winner_id:
+            # Winner gets pot minus commission
+            entry_type, amount = TransactionType.MATCH_WIN, winner_payout - stake
+            stats = {"stats.wins": 1, "stats.total_won": winner_payout}
+        else:
+            # Loser loses their stake
+            entry_type, amount = TransactionType.MATCH_LOSS, -stake
+            stats = {"stats.losses": 1}
+        ledger.append(Transaction(
+            id=f"{match_id}:{entry_type.value}:{player_id}",
+            user_id=player_id,
+            match_id=match_id,
+            type=entry_type,
+            amount=amount
+        ).dict())
+        balance_updates.append(UpdateOne(
+            {"id": player_id, "settled_matches": {"$ne": match_id}},
+            {"$inc": {"balance": amount, "stats.matches_played": 1, **stats},
+             "$push": {"settled_matches": {"$each": [match_id], "$slice": -SETTLED_MATCHES_KEPT}}}
+        ))
+    
+    try:
+        if MONGO_TRANSACTIONS:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    await db.transactions.bulk_write([InsertOne(entry) for entry in ledger], session=session)
+                    await db.users.bulk_write(balance_updates, ordered=False, session=session)
+        else:
+            try:
+                await db.transactions.bulk_write([InsertOne(entry) for entry in ledger], ordered=False)
+            except (BulkWriteError, DuplicateKeyError) as e:
+                # Written by an earlier attempt, whose balance updates may have failed
+                if not is_duplicate_key_error(e):
+                    raise
+            await db.users.bulk_write(balance_updates, ordered=False)
+    except (BulkWriteError, DuplicateKeyError) as e:
+        if not is_duplicate_key_error(e):
+            raise
+        logger.info("Match %s is already settled", match_id)
+    finally:
+        for player_id in match.get("players", []):
+            await invalidate_user(player_id)
+
+# Lifecycle
+@app.on_event("startup")
+async def start_background_tasks():
+    if WORKER_COUNT > 1 and not SOCKETIO_MESSAGE_QUEUE:
+        raise RuntimeError("WORKER_COUNT > 1 needs SOCKETIO_MESSAGE_QUEUE")
+    if not sio.manager_initialized:
+        # Listen to the other workers before the first socket connects
+        sio.manager_initialized = True
+        sio.manager.initialize()
+    await ensure_indexes()
+    await load_lobby_index()
+    background_tasks.append(asyncio.create_task(write_behind_flusher()))
+    background_tasks.append(asyncio.create_task(loop_lag_probe()))
+    if TURN_TIMEOUT_SECONDS > 0:
+        await load_turn_timeouts()
+        background_tasks.append(asyncio.create_task(turn_timeout_scheduler()))
+    if BOT_COUNT > 0:
+        await ensure_bot_users()
+        if BOT_FILL_AFTER_SECONDS > 0:
+            background_tasks.append(asyncio.create_task(bot_table_filler()))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    for task in list(bot_turns.values()):
+        task.cancel()
+    written = await flush_games()
+    await flush_chat_messages()
+    await release_finished_games(written)
+    password_executor.shutdown(wait=False)
+    if bot_executor is not None:
+        bot_executor.shutdown(wait=False, cancel_futures=True)
+    await worker_client.aclose()
+    client.close()
 
 # Configure logging
 logging.basicConfig(
@@ -706,6 +3094,57 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def run_workers(count, host, port):
+    """Run count single-process workers on consecutive ports sharing one message queue.
+    
+    Unless SOCKETIO_MESSAGE_QUEUE names a redis:// or tcp:// queue, this
+    process runs a message hub on MESSAGE_HUB_PORT for the workers.
+    """
+    import subprocess
+    import sys
+    
+    message_queue = SOCKETIO_MESSAGE_QUEUE
+    if not message_queue.startswith(("redis", "tcp://")):
+        # Bound before the workers start, so their first connect finds it
+        hub_socket = socket.create_server(("127.0.0.1", MESSAGE_HUB_PORT))
+        message_queue = f"tcp://127.0.0.1:{hub_socket.getsockname()[1]}"
+        threading.Thread(target=asyncio.run, args=(serve_message_hub(hub_socket),), daemon=True).start()
+    
+    urls = [f"http://127.0.0.1:{port + index}" for index in range(count)]
+    processes = []
+    for index in range(count):
+        env = {
+            **os.environ,
+            "WORKER_ID": str(index),
+            "WORKER_COUNT": str(count),
+            "WORKER_URLS": ",".join(urls),
+            "SOCKETIO_MESSAGE_QUEUE": message_queue,
+        }
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:socket_app", "--host", host,
+             "--port", str(port + index), "--ws-per-message-deflate", str(SOCKETIO_COMPRESSION).lower()],
+            cwd=ROOT_DIR, env=env
+        ))
+    try:
+        for process in processes:
+            process.wait()
+    finally:
+        for process in processes:
+            process.terminate()
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run("server:socket_app", host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes, on consecutive ports behind a load balancer")
+    args = parser.parse_args()
+    
+    if args.workers > 1:
+        run_workers(args.workers, args.host, args.port)
+    else:
+        uvicorn.run("server:socket_app", host=args.host, port=args.port, reload=True,
+                    ws_per_message_deflate=SOCKETIO_COMPRESSION)
\ No newline at end of file
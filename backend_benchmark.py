@@ -0,0 +1,215 @@
+"""Micro-benchmarks for the Chinchón rules engine in backend/server.py.
+
+Inputs come from a fixed random seed: hands are dealt from shuffled decks the
+way join_match deals them, and candidate melds mix real sequences and sets
+with random draws. Results are written as JSON, and --compare fails when a
+benchmark got slower than a stored baseline by more than --threshold.
+
+    python backend_benchmark.py --json benchmarks/baseline.json
+    python backend_benchmark.py --compare benchmarks/baseline.json --threshold 0.10
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017/chinchon_benchmark")
+
+import server
+from server import (
+    CARD_DICTS, RANK_MASKS, SUIT_MASKS, calculate_unmelded_points, create_spanish_deck,
+    deal_game, find_best_melds, is_valid_sequence, is_valid_set, mask_to_dicts, solve_melds,
+)
+
+SEED = 20240601
+SAMPLE_SIZE = 2000
+
+
+def dealt_hands(rng, count, size):
+    """Hands of size cards, each the start of a freshly shuffled deck"""
+    hands = []
+    for _ in range(count):
+        deck = create_spanish_deck()
+        rng.shuffle(deck)
+        hands.append([CARD_DICTS[card] for card in deck[:size]])
+    return hands
+
+
+def candidate_melds(rng, count):
+    """Valid sequences and sets mixed with random 3-4 card draws, as a player would try them"""
+    melds = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.3:
+            suit_mask = rng.choice(SUIT_MASKS)
+            start = (suit_mask & -suit_mask).bit_length() - 1 + rng.randrange(8)
+            length = min(rng.choice((3, 4, 5)), (suit_mask.bit_length() - start))
+            melds.append(mask_to_dicts(sum(1 << card for card in range(start, start + length))))
+        elif kind < 0.6:
+            rank_mask = rng.choice(RANK_MASKS)
+            cards = [card for card in range(40) if rank_mask >> card & 1]
+            melds.append(mask_to_dicts(sum(1 << card for card in rng.sample(cards, rng.choice((3, 4))))))
+        else:
+            melds.append([CARD_DICTS[card] for card in rng.sample(range(40), rng.choice((3, 4)))])
+    return melds
+
+
+def build_inputs(seed):
+    rng = random.Random(seed)
+    hands7 = dealt_hands(rng, SAMPLE_SIZE, 7)
+    hands8 = dealt_hands(rng, SAMPLE_SIZE, 8)
+    melds = candidate_melds(rng, SAMPLE_SIZE)
+    solved = [find_best_melds(hand) for hand in hands8]
+    return {
+        "hands7": hands7,
+        "hands8": hands8,
+        "melds": melds,
+        "solved": list(zip(hands8, solved)),
+        "seeds": [rng.getrandbits(63) for _ in range(SAMPLE_SIZE)],
+    }
+
+
+def benchmarks(inputs):
+    """name -> (function running one pass over its inputs, operations per pass)"""
+    hands7, hands8, melds = inputs["hands7"], inputs["hands8"], inputs["melds"]
+    players = ["player-1", "player-2"]
+
+    def create_deck():
+        for _ in range(SAMPLE_SIZE):
+            create_spanish_deck()
+
+    def best_melds_cold(hands):
+        def run():
+            solve_melds.cache_clear()
+            for hand in hands:
+                find_best_melds(hand)
+        return run
+
+    def best_melds_warm():
+        for hand in hands8:
+            find_best_melds(hand)
+
+    def unmelded_points():
+        for hand, (sequences, sets) in inputs["solved"]:
+            calculate_unmelded_points(hand, sequences, sets)
+
+    def valid_sequence():
+        for meld in melds:
+            is_valid_sequence(meld)
+
+    def valid_set():
+        for meld in melds:
+            is_valid_set(meld)
+
+    def shuffle_and_deal():
+        for seed in inputs["seeds"]:
+            deal_game(players, seed)
+
+    return {
+        "create_spanish_deck": (create_deck, SAMPLE_SIZE),
+        "find_best_melds_7_cold": (best_melds_cold(hands7), len(hands7)),
+        "find_best_melds_8_cold": (best_melds_cold(hands8), len(hands8)),
+        "find_best_melds_8_warm": (best_melds_warm, len(hands8)),
+        "calculate_unmelded_points": (unmelded_points, len(inputs["solved"])),
+        "is_valid_sequence": (valid_sequence, len(melds)),
+        "is_valid_set": (valid_set, len(melds)),
+        "shuffle_and_deal": (shuffle_and_deal, len(inputs["seeds"])),
+    }
+
+
+def measure(function, operations, repeats, min_time):
+    """Per-operation timings in ns over repeats, each repeat lasting at least min_time seconds"""
+    function()  # warm up
+    samples = []
+    for _ in range(repeats):
+        passes = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            passes += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        samples.append(elapsed / (passes * operations) * 1e9)
+    return {
+        "median_ns": statistics.median(samples),
+        "min_ns": min(samples),
+        "stdev_ns": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "repeats": repeats,
+    }
+
+
+def run_benchmarks(args):
+    inputs = build_inputs(args.seed)
+    results = {}
+    for name, (function, operations) in benchmarks(inputs).items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(function, operations, args.repeats, args.min_time)
+        print(f"   {name:<28}{results[name]['median_ns']:>12.0f} ns/op"
+              f"   (min {results[name]['min_ns']:.0f}, ±{results[name]['stdev_ns']:.0f})")
+    return {
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "meld_cache_size": server.MELD_CACHE_SIZE,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """Print the change against a baseline; return the benchmarks that regressed"""
+    regressions = []
+    print(f"\n   {'benchmark':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in report["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"   {name:<28}{'-':>12}{result['median_ns']:>12.0f}{'new':>10}")
+            continue
+        change = result["median_ns"] / previous["median_ns"] - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  ❌"
+        print(f"   {name:<28}{previous['median_ns']:>12.0f}{result['median_ns']:>12.0f}{change:>+10.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--json", help="write the results to this file, e.g. as a new baseline")
+    parser.add_argument("--compare", help="baseline file to compare the results against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown of the median before --compare fails (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    print(f"⏱️  Rules engine benchmarks (seed {args.seed}, {args.repeats} repeats)")
+    report = run_benchmarks(args)
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get("seed") != report["seed"]:
+            print(f"⚠️  Baseline was recorded with seed {baseline.get('seed')}")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ Regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
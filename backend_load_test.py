@@ -0,0 +1,333 @@
+"""Load test for the Chinchón backend.
+
+Starts server:socket_app in a child process against an in-memory MongoDB
+stand-in, then runs bot players that register, get paired through the
+matchmaking queue and play complete games over Socket.IO with game_action.
+Reports p50/p95/p99 latency per event and overall throughput.
+
+    python backend_load_test.py --players 2000 --ramp-up 20
+    python backend_load_test.py --players 500 --codec msgpack --json results.json
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017/chinchon_load_test")
+
+import httpx
+import msgpack
+import socketio
+from in_memory_mongo import InMemoryDatabase
+# The bots reuse the server's rules engine to decide their moves
+from server import CARD_IDS, CARD_INDEX, CLOSE_MAX_POINTS, hand_mask, mask_cards, solve_melds
+
+
+def run_server(port, bcrypt_rounds):
+    """Serve server:socket_app on an in-memory database (the --serve child process)"""
+    import bcrypt
+    import uvicorn
+    import server
+
+    # Password hashing cost is not what is being measured
+    bcrypt.gensalt = functools.partial(bcrypt.gensalt, rounds=bcrypt_rounds)
+    server.db = InMemoryDatabase()
+    logging.getLogger("socketio").setLevel(logging.WARNING)
+    logging.getLogger("engineio").setLevel(logging.WARNING)
+    server.sio.logger.setLevel(logging.WARNING)
+    uvicorn.run(server.socket_app, host="127.0.0.1", port=port, log_level="warning",
+                ws_per_message_deflate=False)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadTestMetrics:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.games_finished = 0
+        self.games_abandoned = 0
+        self.actions = 0
+        self.started = time.perf_counter()
+
+    def record(self, event, seconds):
+        self.latencies[event].append(seconds)
+
+    def report(self):
+        duration = time.perf_counter() - self.started
+        events = {}
+        for event, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            events[event] = {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return {
+            "duration_s": duration,
+            "games_finished": self.games_finished,
+            "games_abandoned": self.games_abandoned,
+            "actions": self.actions,
+            "actions_per_s": self.actions / duration if duration else 0.0,
+            "games_per_s": self.games_finished / duration if duration else 0.0,
+            "errors": dict(self.errors),
+            "events": events,
+        }
+
+
+class BotPlayer:
+    """A player that registers, queues for a match and plays it to the end"""
+    def __init__(self, harness, index):
+        self.harness = harness
+        self.username = f"bot_{harness.run_id}_{index}"
+        self.user_id = None
+        self.headers = None
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.match_id = None
+        self.matched = asyncio.get_running_loop().create_future()
+        self.done = asyncio.get_running_loop().create_future()
+        self.joined_at = None
+        self.hand = 0
+        self.phase = None
+        self.deck_count = 0
+        self.turns = 0
+        self.pending = None
+        self.client.on("*", self.on_event)
+
+    async def request(self, event, method, path, **kwargs):
+        """REST call with latency recorded; retries while the server sheds load"""
+        while True:
+            started = time.perf_counter()
+            response = await self.harness.http.request(method, path, headers=self.headers, **kwargs)
+            if response.status_code != 503:
+                break
+            self.harness.metrics.errors[f"{event}_503"] += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+        self.harness.metrics.record(event, time.perf_counter() - started)
+        response.raise_for_status()
+        return response.json()
+
+    async def run(self):
+        async with self.harness.register_slots:
+            token = await self.request("register", "POST", "/api/auth/register",
+                                       json={"username": self.username, "password": "load-test"})
+        self.headers = {"Authorization": f"Bearer {token['access_token']}"}
+        self.user_id = (await self.request("auth_me", "GET", "/api/auth/me"))["id"]
+
+        started = time.perf_counter()
+        await self.client.connect(self.harness.url, transports=["websocket"],
+                                  auth={"codec": self.harness.args.codec, "token": token["access_token"]})
+        self.harness.metrics.record("connect", time.perf_counter() - started)
+
+        result = await self.request("matchmaking", "POST", "/api/matchmaking", json={
+            "target_points": self.harness.args.target_points,
+            "min_stake": self.harness.args.stake,
+            "max_stake": self.harness.args.stake,
+        })
+        if result["status"] == "matched":
+            self.matched.set_result(result["match"]["id"])
+        self.match_id = await asyncio.wait_for(self.matched, self.harness.args.game_timeout)
+        self.harness.games[self.match_id].append(self)
+
+        self.joined_at = time.perf_counter()
+        await self.client.emit("join_match_room", {"match_id": self.match_id})
+        try:
+            outcome = await asyncio.wait_for(self.done, self.harness.args.game_timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        await self.client.disconnect()
+        return outcome
+
+    async def on_event(self, event, data=None):
+        if isinstance(data, (bytes, bytearray)):
+            data = msgpack.unpackb(data)
+        if event == "match_found" and not self.matched.done():
+            self.matched.set_result(data["match_id"])
+        elif event == "match_state":
+            if self.joined_at is not None:
+                self.harness.metrics.record("join_match_room", time.perf_counter() - self.joined_at)
+                self.joined_at = None
+            # Sent on joining and again with the new hand of every round
+            state = data["state"]
+            me = state["players"][self.user_id]
+            self.hand = hand_mask(CARD_INDEX[card["id"]] for card in me["hand"])
+            self.phase = state["phase"]
+            self.deck_count = state["deck_count"]
+            if state["current_turn"] == self.user_id:
+                await self.act()
+        elif event == "match_delta":
+            await self.on_delta(data)
+        elif event == "error":
+            self.harness.metrics.errors[data.get("message", "error")] += 1
+            self.pending = None
+            self.finish("abandoned")
+
+    async def on_delta(self, delta):
+        self.deck_count = delta["deck_count"]
+        if delta["player_id"] == self.user_id and self.pending:
+            action, started = self.pending
+            self.pending = None
+            self.harness.metrics.record(action, time.perf_counter() - started)
+            self.harness.metrics.actions += 1
+            if action in ("draw_stock", "draw_discard"):
+                self.hand |= 1 << CARD_INDEX[delta["card"]["id"]]
+        if delta.get("status") == "finished":
+            self.finish("finished")
+            return
+        if delta["action"] == "close":
+            # The next round's match_state follows
+            return
+        self.phase = delta["phase"]
+        if delta["current_turn"] == self.user_id:
+            await self.act()
+
+    async def act(self):
+        if self.done.done():
+            return
+        if self.phase == "draw":
+            self.turns += 1
+            if self.turns > self.harness.args.max_turns:
+                self.finish("abandoned")
+            elif solve_melds(self.hand)[0] <= CLOSE_MAX_POINTS:
+                await self.send("close")
+            else:
+                await self.send("draw_stock" if self.deck_count else "draw_discard")
+        elif self.phase == "discard":
+            # Keep the seven cards with the least unmelded points
+            card = min(mask_cards(self.hand), key=lambda card: solve_melds(self.hand & ~(1 << card))[0])
+            self.hand &= ~(1 << card)
+            await self.send("discard", {"card_id": CARD_IDS[card]})
+
+    async def send(self, action, payload=None):
+        self.pending = (action, time.perf_counter())
+        await self.client.emit("game_action", {
+            "match_id": self.match_id, "action": action, "payload": payload or {}
+        })
+
+    def finish(self, outcome):
+        """End this bot's game and its opponent's"""
+        for bot in self.harness.games.get(self.match_id, [self]):
+            if not bot.done.done():
+                bot.done.set_result(outcome)
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.url = f"http://127.0.0.1:{args.port}"
+        self.run_id = int(time.time())
+        self.metrics = LoadTestMetrics()
+        self.games = defaultdict(list)
+        self.http = None
+        self.register_slots = None
+
+    async def wait_for_server(self, process):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("Server process exited during startup")
+            try:
+                if (await self.http.get("/api/avatars")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError("Server did not start within 30 seconds")
+
+    async def run_bot(self, index):
+        await asyncio.sleep(self.args.ramp_up * index / self.args.players)
+        bot = BotPlayer(self, index)
+        try:
+            return await bot.run()
+        except Exception as e:
+            self.metrics.errors[type(e).__name__] += 1
+            if bot.match_id:
+                bot.finish("abandoned")
+            return "failed"
+
+    async def run(self):
+        process = subprocess.Popen(
+            [sys.executable, __file__, "--serve", "--port", str(self.args.port),
+             "--bcrypt-rounds", str(self.args.bcrypt_rounds)],
+            stdout=subprocess.DEVNULL
+        )
+        limits = httpx.Limits(max_connections=self.args.http_connections)
+        self.http = httpx.AsyncClient(base_url=self.url, limits=limits, timeout=60.0)
+        self.register_slots = asyncio.Semaphore(self.args.register_concurrency)
+        try:
+            await self.wait_for_server(process)
+            print(f"🚀 {self.args.players} players against {self.url} "
+                  f"(ramp-up {self.args.ramp_up}s, codec {self.args.codec})")
+            self.metrics.started = time.perf_counter()
+            outcomes = await asyncio.gather(*(self.run_bot(index) for index in range(self.args.players)))
+        finally:
+            await self.http.aclose()
+            process.terminate()
+            process.wait()
+        self.metrics.games_finished = outcomes.count("finished") // 2
+        self.metrics.games_abandoned = len(self.games) - self.metrics.games_finished
+        for outcome in ("timeout", "failed"):
+            if outcomes.count(outcome):
+                self.metrics.errors[outcome] += outcomes.count(outcome)
+        return self.metrics.report()
+
+
+def print_report(report):
+    print(f"\n📊 {report['duration_s']:.1f}s: {report['games_finished']} games finished, "
+          f"{report['games_abandoned']} abandoned, {report['actions']} actions")
+    print(f"   Throughput: {report['actions_per_s']:.1f} actions/s, {report['games_per_s']:.2f} games/s")
+    print(f"\n   {'event':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for event, stats in report["events"].items():
+        print(f"   {event:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    if report["errors"]:
+        print(f"\n❌ Errors: {json.dumps(report['errors'], indent=2)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000, help="bot players (two per game)")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="seconds over which bots start")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--codec", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--target-points", type=int, default=100)
+    parser.add_argument("--stake", type=float, default=10.0)
+    parser.add_argument("--max-turns", type=int, default=300,
+                        help="turns per player, over all rounds, before a game is abandoned")
+    parser.add_argument("--game-timeout", type=float, default=300.0)
+    parser.add_argument("--register-concurrency", type=int, default=32)
+    parser.add_argument("--http-connections", type=int, default=200)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args.port, args.bcrypt_rounds)
+        return
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
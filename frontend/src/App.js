@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { BrowserRouter, Routes, Route, Navigate } from "react-router-dom";
 import axios from "axios";
 import io from "socket.io-client";
@@ -43,6 +43,38 @@ const Card = ({ card, onClick, selected, disabled }) => {
   );
 };
 
+// Apply a match_delta to the redacted state from the last match_state
+const applyMatchDelta = (state, delta, userId) => {
+  const actor = { ...state.players[delta.player_id], hand_count: delta.hand_count };
+  if (delta.player_id === userId && delta.card) {
+    if (delta.action === "discard") {
+      actor.hand = actor.hand.filter((card) => card.id !== delta.card.id);
+    } else if (delta.action === "draw_stock" || delta.action === "draw_discard") {
+      actor.hand = [...actor.hand, delta.card];
+    }
+  }
+  if (delta.player_id === userId && delta.hint) {
+    actor.hint = delta.hint;
+  }
+  const players = { ...state.players, [delta.player_id]: actor };
+  if (delta.round_result) {
+    // Totals after the closed round; the next deal arrives as a match_state
+    for (const [playerId, total] of Object.entries(delta.round_result.totals)) {
+      players[playerId] = { ...players[playerId], points: total };
+    }
+  }
+  return {
+    ...state,
+    players,
+    current_turn: delta.current_turn,
+    phase: delta.phase,
+    deck_count: delta.deck_count,
+    discard_count: delta.discard_count,
+    discard_top: delta.discard_top,
+    turn_start_time: delta.turn_start_time || state.turn_start_time
+  };
+};
+
 // Chat component
 const ChatComponent = ({ matchId, currentUser }) => {
   const [messages, setMessages] = useState([]);
@@ -89,7 +121,6 @@ const ChatComponent = ({ matchId, currentUser }) => {
     if (newMessage.trim() && socket) {
       socket.emit("send_chat_message", {
         match_id: matchId,
-        user_id: currentUser.id,
         content: newMessage.trim()
       });
       setNewMessage("");
@@ -137,28 +168,55 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
   const [selectedCard, setSelectedCard] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Seq of the last match_state or delta applied; null until the first match_state
+  const seqRef = useRef(null);
 
   useEffect(() => {
-    if (socket && matchId) {
-      // Join match room
-      socket.emit("join_match_room", { 
-        match_id: matchId, 
-        user_id: user.id 
+    // Join (or rejoin after a reconnect) the match room; once a state is held, only
+    // the deltas missed since its seq are sent back
+    const joinRoom = () => {
+      socket.emit("join_match_room", {
+        match_id: matchId,
+        ...(seqRef.current !== null && { last_seq: seqRef.current })
       });
+    };
+
+    if (socket && matchId) {
+      joinRoom();
+      socket.on("connect", joinRoom);
 
       // Listen for game state updates
       socket.on("match_state", (data) => {
         console.log("Game state update:", data);
         if (data.state && Object.keys(data.state).length > 0) {
+          seqRef.current = data.seq;
           setGameState(data.state);
           setLoading(false);
         }
       });
 
+      socket.on("match_delta", (delta) => {
+        if (delta.match_id !== matchId || seqRef.current === null) return;
+        if (delta.seq <= seqRef.current) return;
+        if (delta.seq !== seqRef.current + 1) {
+          // Missed an update: ask for what came after the last one applied
+          joinRoom();
+          return;
+        }
+        seqRef.current = delta.seq;
+        setGameState((prev) => (prev ? applyMatchDelta(prev, delta, user.id) : prev));
+        // A round that continues is followed by a match_state with the new deal
+        if (delta.status && delta.status !== "playing") {
+          loadMatchData();
+        }
+      });
+
       socket.on("joined_room", (data) => {
         console.log("Joined room:", data);
-        // After joining room, load match data
-        loadMatchData();
+        // After joining room, load match data unless only missed deltas were replayed
+        if (!data.resumed) {
+          loadMatchData();
+        }
       });
 
       socket.on("error", (errorData) => {
@@ -173,7 +231,9 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
 
     return () => {
       if (socket) {
+        socket.off("connect", joinRoom);
         socket.off("match_state");
+        socket.off("match_delta");
         socket.off("joined_room");
         socket.off("error");
         if (matchId) {
@@ -191,12 +251,6 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
       const matchData = response.data;
       setMatch(matchData);
       
-      // If match has game state, use it
-      if (matchData.game_state && Object.keys(matchData.game_state).length > 0) {
-        setGameState(matchData.game_state);
-        setLoading(false);
-      }
-      
       console.log("Match data loaded:", matchData);
     } catch (error) {
       console.error("Error loading match:", error);
@@ -209,7 +263,6 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
     if (socket && gameState) {
       socket.emit("game_action", {
         match_id: matchId,
-        user_id: user.id,
         action: action,
         payload: payload
       });
@@ -330,17 +383,17 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
                     ${canDraw ? 'cursor-pointer hover:bg-blue-700 hover:transform hover:-translate-y-1' : 'opacity-50'}
                     transition-all duration-200`}
                 >
-                  {gameState.deck?.length || 0}
+                  {gameState.deck_count || 0}
                 </div>
               </div>
               
               {/* Discard Pile */}
               <div className="text-center">
                 <h3 className="text-sm font-semibold text-white mb-2">Discard Pile</h3>
-                {gameState.discard_pile && gameState.discard_pile.length > 0 ? (
+                {gameState.discard_top ? (
                   <div onClick={canDraw ? handleDrawDiscard : undefined}>
                     <Card 
-                      card={gameState.discard_pile[gameState.discard_pile.length - 1]} 
+                      card={gameState.discard_top} 
                       disabled={!canDraw}
                     />
                   </div>
@@ -364,7 +417,8 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
                     </button>
                     <button
                       onClick={handleClose}
-                      className="px-4 py-2 bg-orange-600 hover:bg-orange-700 text-white rounded-xl transition-colors"
+                      disabled={currentPlayer?.hint && !currentPlayer.hint.can_close}
+                      className="px-4 py-2 bg-orange-600 hover:bg-orange-700 disabled:bg-slate-600 disabled:cursor-not-allowed text-white rounded-xl transition-colors"
                     >
                       Close Game
                     </button>
@@ -380,7 +434,9 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
 
             {/* Current Player's Hand */}
             <div>
-              <h3 className="text-lg font-semibold text-white mb-4">Your Hand ({currentPlayer?.hand?.length || 0} cards)</h3>
+              <h3 className="text-lg font-semibold text-white mb-4">
+                Your Hand ({currentPlayer?.hand?.length || 0} cards{currentPlayer?.hint ? ` • ${currentPlayer.hint.points} points` : ''})
+              </h3>
               <div className="flex flex-wrap gap-2 justify-center">
                 {currentPlayer?.hand?.map((card) => (
                   <Card
@@ -403,7 +459,7 @@ const GameRoom = ({ matchId, user, onLeaveMatch }) => {
                   <div className="text-sm text-slate-400">Player {index + 1}</div>
                   <div className="font-semibold">{playerId === user.id ? 'You' : 'Opponent'}</div>
                   <div className="text-xs text-slate-500">
-                    {gameState.players?.[playerId]?.hand?.length || 0} cards
+                    {gameState.players?.[playerId]?.hand_count || 0} cards
                   </div>
                 </div>
               ))}
@@ -571,8 +627,30 @@ const Lobby = ({ user, onJoinMatch }) => {
 
   useEffect(() => {
     fetchMatches();
-    const interval = setInterval(fetchMatches, 2000);
-    return () => clearInterval(interval);
+    if (!socket) {
+      const interval = setInterval(fetchMatches, 2000);
+      return () => clearInterval(interval);
+    }
+
+    // Waiting matches are pushed over the lobby room instead of polled
+    const subscribe = () => socket.emit("subscribe_lobby");
+    socket.on("connect", subscribe);
+    socket.on("lobby_snapshot", (data) => setMatches(data.matches));
+    socket.on("lobby_add", (match) => {
+      setMatches((prev) => [match, ...prev.filter((m) => m.id !== match.id)]);
+    });
+    socket.on("lobby_remove", ({ id }) => {
+      setMatches((prev) => prev.filter((m) => m.id !== id));
+    });
+    subscribe();
+
+    return () => {
+      socket.off("connect", subscribe);
+      socket.off("lobby_snapshot");
+      socket.off("lobby_add");
+      socket.off("lobby_remove");
+      socket.emit("unsubscribe_lobby");
+    };
   }, []);
 
   const fetchMatches = async () => {
@@ -773,6 +851,8 @@ function App() {
         // Initialize socket connection with proper configuration
         if (!socket) {
           socket = io(BACKEND_URL, {
+            // The JWT is checked once in the handshake (and again on each reconnect)
+            auth: (cb) => cb({ token: localStorage.getItem("token") }),
             transports: ['websocket', 'polling'],
             timeout: 10000,
             forceNew: true
@@ -0,0 +1,326 @@
+"""In-memory stand-in for the motor database used by backend/server.py.
+
+Implements the queries, updates and bulk writes the server issues, with
+unique indexes enforced so duplicate ledger and event writes fail the way
+they do on MongoDB. Shared by the load test and the pytest suite.
+"""
+import copy
+import itertools
+from types import SimpleNamespace
+
+from pymongo import DeleteOne, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+class InMemoryCursor:
+    """Cursor over a snapshot of matching documents"""
+    def __init__(self, docs, projection):
+        self.docs = docs
+        self.projection = projection
+        self.sort_keys = []
+        self.skip_count = 0
+        self.limit_count = 0
+
+    def sort(self, key, direction=1):
+        self.sort_keys.extend(key if isinstance(key, list) else [(key, direction)])
+        return self
+
+    def skip(self, count):
+        self.skip_count = count
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def results(self):
+        docs = list(self.docs)
+        for key, direction in reversed(self.sort_keys):
+            docs.sort(key=lambda doc: (get_field(doc, key) is None, get_field(doc, key)), reverse=direction < 0)
+        docs = docs[self.skip_count:]
+        if self.limit_count:
+            docs = docs[:self.limit_count]
+        return [project(doc, self.projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        docs = self.results()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        self.iterator = iter(self.results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def get_field(doc, dotted):
+    for part in dotted.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def set_field(doc, dotted, value):
+    parts = dotted.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_field(doc, dotted):
+    parts = dotted.split(".")
+    parent = get_field(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+
+
+def matches_condition(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        # Like MongoDB, an array field matches when any element does
+        values = value if isinstance(value, list) else [value]
+        for operator, argument in condition.items():
+            if operator == "$in" and not any(item in argument for item in values):
+                return False
+            if operator == "$nin" and any(item in argument for item in values):
+                return False
+            if operator == "$ne" and argument in values:
+                return False
+            if operator == "$exists" and (value is not None) != argument:
+                return False
+            if operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if operator == "$gt" and not value > argument:
+                    return False
+                if operator == "$gte" and not value >= argument:
+                    return False
+                if operator == "$lt" and not value < argument:
+                    return False
+                if operator == "$lte" and not value <= argument:
+                    return False
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches_filter(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches_filter(doc, branch) for branch in condition):
+                return False
+        elif key == "$and":
+            if not all(matches_filter(doc, branch) for branch in condition):
+                return False
+        elif not matches_condition(get_field(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [key for key, value in projection.items() if value and key != "_id"]
+    if included:
+        fields = included + (["_id"] if projection.get("_id", 1) else [])
+        return {key: copy.deepcopy(doc[key]) for key in fields if key in doc}
+    return {key: copy.deepcopy(value) for key, value in doc.items() if projection.get(key, 1)}
+
+
+class InMemoryCollection:
+    """The subset of a motor collection that server.py uses, with unique indexes"""
+    object_ids = itertools.count(1)
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+        self.by_id = {}
+        self.unique_indexes = {}
+        self.indexes = {}
+
+    def candidates(self, query):
+        # Equality on "id" is the hot path; everything else scans
+        if query and "id" in query and not isinstance(query["id"], dict):
+            doc = self.by_id.get(query["id"])
+            return [doc] if doc is not None else []
+        return self.docs
+
+    def find_docs(self, query):
+        return [doc for doc in self.candidates(query) if matches_filter(doc, query)]
+
+    def unique_key(self, fields, doc):
+        return tuple(get_field(doc, field) for field in fields)
+
+    def add(self, doc):
+        doc.setdefault("_id", next(self.object_ids))
+        keys = {name: self.unique_key(fields, doc) for name, (fields, _) in self.unique_indexes.items()}
+        for name, key in keys.items():
+            if key in self.unique_indexes[name][1]:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+        for name, key in keys.items():
+            self.unique_indexes[name][1].add(key)
+        doc = copy.deepcopy(doc)
+        self.docs.append(doc)
+        if "id" in doc:
+            self.by_id[doc["id"]] = doc
+
+    def remove(self, doc):
+        for fields, keys in self.unique_indexes.values():
+            keys.discard(self.unique_key(fields, doc))
+        self.docs.remove(doc)
+        if self.by_id.get(doc.get("id")) is doc:
+            del self.by_id[doc["id"]]
+
+    def apply_update(self, doc, update):
+        for fields, keys in self.unique_indexes.values():
+            keys.discard(self.unique_key(fields, doc))
+        for operator, fields in update.items():
+            for key, value in fields.items():
+                if operator == "$set":
+                    set_field(doc, key, copy.deepcopy(value))
+                elif operator == "$inc":
+                    set_field(doc, key, (get_field(doc, key) or 0) + value)
+                elif operator == "$push":
+                    items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                    items = (get_field(doc, key) or []) + copy.deepcopy(items)
+                    if isinstance(value, dict) and "$slice" in value:
+                        size = value["$slice"]
+                        items = items[size:] if size < 0 else items[:size]
+                    set_field(doc, key, items)
+                elif operator == "$unset":
+                    unset_field(doc, key)
+                elif operator != "$setOnInsert":
+                    raise NotImplementedError(operator)
+        for fields, keys in self.unique_indexes.values():
+            keys.add(self.unique_key(fields, doc))
+        if "id" in doc:
+            self.by_id[doc["id"]] = doc
+
+    async def create_indexes(self, models):
+        names = []
+        for model in models:
+            document = model.document
+            fields = list(document["key"].keys())
+            if document.get("unique"):
+                self.unique_indexes[document["name"]] = (
+                    fields, {self.unique_key(fields, doc) for doc in self.docs}
+                )
+            self.indexes[document["name"]] = document
+            names.append(document["name"])
+        return names
+
+    async def create_index(self, keys, **kwargs):
+        return (await self.create_indexes([IndexModel(keys, **kwargs)]))[0]
+
+    async def index_information(self):
+        return {name: {"key": list(document["key"].items())} for name, document in self.indexes.items()}
+
+    def aggregate(self, pipeline):
+        return InMemoryCursor([], None)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        cursor = InMemoryCursor(self.find_docs(query), projection)
+        if sort:
+            cursor.sort(sort)
+        results = cursor.limit(1).results()
+        return results[0] if results else None
+
+    def find(self, query=None, projection=None):
+        return InMemoryCursor(self.find_docs(query), projection)
+
+    async def count_documents(self, query):
+        return len(self.find_docs(query))
+
+    async def insert_one(self, doc, session=None):
+        self.add(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True, session=None):
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self.add(doc)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return SimpleNamespace(inserted_ids=[doc["_id"] for doc in docs])
+
+    async def update_one(self, query, update, upsert=False, session=None):
+        docs = self.find_docs(query)
+        if docs:
+            self.apply_update(docs[0], update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        doc = {key: copy.deepcopy(value) for key, value in query.items()
+               if not key.startswith("$") and not isinstance(value, dict)}
+        doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+        self.apply_update(doc, update)
+        self.add(doc)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+
+    async def update_many(self, query, update, session=None):
+        docs = self.find_docs(query)
+        for doc in docs:
+            self.apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs))
+
+    async def delete_one(self, query, session=None):
+        docs = self.find_docs(query)
+        if docs:
+            self.remove(docs[0])
+        return SimpleNamespace(deleted_count=len(docs[:1]))
+
+    async def delete_many(self, query, session=None):
+        docs = self.find_docs(query)
+        for doc in docs:
+            self.remove(doc)
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def bulk_write(self, requests, ordered=True, session=None):
+        matched = inserted = 0
+        errors = []
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                try:
+                    self.add(request._doc)
+                    inserted += 1
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                    if ordered:
+                        break
+            elif isinstance(request, UpdateOne):
+                result = await self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+                matched += result.matched_count
+            elif isinstance(request, DeleteOne):
+                await self.delete_one(request._filter)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": inserted, "nMatched": matched})
+        return SimpleNamespace(matched_count=matched, modified_count=matched, inserted_count=inserted)
+
+
+class InMemoryDatabase:
+    """Stand-in for the motor database: collections are created on first use"""
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = InMemoryCollection(name)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "collections":
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, *args, **kwargs):
+        return {"ok": 1}
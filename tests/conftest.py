@@ -0,0 +1,80 @@
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# server.py reads its settings at import; keep it off any real cluster
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017/chinchon_test')
+os.environ.setdefault('DB_NAME', 'chinchon_test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import server as server_module  # noqa: E402
+
+from in_memory_mongo import InMemoryDatabase  # noqa: E402
+
+# In-memory state that must not leak from one test into the next
+SERVER_STATE = [
+    'active_games', 'dirty_games', 'match_player_sids', 'sid_matches', 'binary_sids', 'lobby_matches',
+    'lobby_keys', 'match_deltas', 'pending_chat_messages', 'pending_match_events', 'pending_match_rounds',
+    'matchmaking_queues', 'matchmaking_tickets', 'remote_sessions',
+]
+SERVER_CACHES = ['user_cache', 'token_cache', 'chat_buffers', 'matchmaking_results']
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def emitted():
+    """Socket.IO emits of the test, as (event, data, room) tuples"""
+    return []
+
+
+@pytest.fixture
+async def server(monkeypatch, emitted):
+    """The server module on an empty in-memory database, with Socket.IO emits recorded"""
+    async def emit(event, data=None, room=None, to=None, **kwargs):
+        emitted.append((event, data, room or to))
+
+    async def enter_room(sid, room, namespace=None):
+        pass
+
+    monkeypatch.setattr(server_module, 'db', InMemoryDatabase())
+    monkeypatch.setattr(server_module.sio, 'emit', emit)
+    monkeypatch.setattr(server_module.sio, 'enter_room', enter_room)
+    monkeypatch.setattr(server_module.sio, 'leave_room', enter_room)
+    await server_module.ensure_indexes()
+    yield server_module
+    for name in SERVER_STATE:
+        getattr(server_module, name).clear()
+    for name in SERVER_CACHES:
+        getattr(server_module, name).entries.clear()
+
+
+@pytest.fixture
+async def api(server):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url='http://test') as client:
+        yield client
+
+
+async def register(api, username):
+    """Register a user and return their auth headers and profile"""
+    response = await api.post('/api/auth/register', json={'username': username, 'password': 'secret'})
+    assert response.status_code == 200, response.text
+    headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+    return headers, (await api.get('/api/auth/me', headers=headers)).json()
+
+
+@pytest.fixture
+async def started_match(api):
+    """Id of a 10-stake match between two fresh users, dealt and in play"""
+    host_headers, _ = await register(api, 'alice')
+    guest_headers, _ = await register(api, 'bob')
+    match = (await api.post('/api/matches', json={'target_points': 50, 'stake_amount': 10}, headers=host_headers)).json()
+    response = await api.post(f"/api/matches/{match['id']}/join", headers=guest_headers)
+    assert response.status_code == 200, response.text
+    return match['id']
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import server
+from tests.test_melds import EDGE_HANDS, RANKS, SUITS, card_points, random_hands, to_mask
+
+
+@pytest.mark.parametrize('size', [7, 8, 10])
+def test_evaluate_hands_batch_matches_solve_melds(size):
+    hands = random_hands(5000, size, size)
+    masks = np.array([to_mask(cards) for cards in hands], dtype=np.uint64)
+    points, unmelded_points, can_close = server.evaluate_hands_batch(masks)
+    expected = [server.solve_melds(to_mask(cards))[0] for cards in hands]
+    assert unmelded_points.tolist() == expected
+    assert points.tolist() == [sum(map(card_points, cards)) for cards in hands]
+    assert can_close.tolist() == [value <= server.CLOSE_MAX_POINTS for value in expected]
+
+
+def test_evaluate_hands_batch_accepts_one_hot_rows():
+    hands = EDGE_HANDS + random_hands(200, 8, 3)
+    one_hot = np.zeros((len(hands), SUITS * RANKS), dtype=np.int8)
+    for row, cards in enumerate(hands):
+        one_hot[row, cards] = 1
+    masks = np.array([to_mask(cards) for cards in hands], dtype=np.uint64)
+    assert server.evaluate_hands_batch(one_hot)[1].tolist() == server.evaluate_hands_batch(masks)[1].tolist()
@@ -0,0 +1,30 @@
+import pytest
+
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_seat_bot_tops_up_through_the_ledger(server, api, monkeypatch):
+    monkeypatch.setattr(server, 'BOT_COUNT', 1)
+    monkeypatch.setattr(server, 'bot_user_ids', set())
+    await server.ensure_bot_users()
+    (bot_id,) = server.bot_user_ids
+    await server.db.users.update_one({'id': bot_id}, {'$set': {'balance': 4.0}})
+    server.user_cache.set(bot_id, {'stale': True}, 60)
+
+    host_headers, _ = await register(api, 'alice')
+    match_id = (await api.post('/api/matches', json={'target_points': 50, 'stake_amount': 10},
+                               headers=host_headers)).json()['id']
+    match = await server.seat_bot(match_id)
+
+    assert bot_id in match['players']
+    bot = await server.db.users.find_one({'id': bot_id})
+    assert bot['balance'] == server.BOT_BALANCE
+    (entry,) = server.db.transactions.docs
+    assert (entry['user_id'], entry['type'], entry['amount']) == (bot_id, 'topup', server.BOT_BALANCE - 4.0)
+    assert server.user_cache.get(bot_id) is None
+
+    # A bot that still covers the stake is left alone
+    await server.top_up_bot(bot_id, 10)
+    assert len(server.db.transactions.docs) == 1
@@ -0,0 +1,20 @@
+import pytest
+
+import server
+from tests.test_melds import EDGE_HANDS, random_hands, to_mask
+
+
+@pytest.mark.parametrize('cards', EDGE_HANDS + random_hands(500, 7, 4) + random_hands(500, 8, 5))
+def test_evaluate_hand_matches_solve_melds(cards):
+    hand = to_mask(cards)
+    evaluation = server.evaluate_hand(hand)
+    assert evaluation['points'] == server.solve_melds(hand)[0]
+    assert evaluation['can_close'] == (evaluation['points'] <= server.CLOSE_MAX_POINTS)
+    if len(cards) <= 7:
+        assert evaluation['discards'] is None
+        return
+    # Every discard is a lookup that agrees with solving the hand left
+    assert set(evaluation['discards']) == set(cards)
+    for card in cards:
+        left = hand & ~(1 << card)
+        assert server.evaluate_discard(evaluation, left, card)['points'] == server.solve_melds(left)[0]
@@ -0,0 +1,87 @@
+import copy
+
+import pytest
+
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+def comparable(game_state):
+    # Replay restarts the turn clock from the event time, not the handler's clock
+    return {key: value for key, value in game_state.items() if key != 'turn_start_time'}
+
+
+async def play_turn(server, match, draw):
+    game_state = match['game_state']
+    player_id = game_state['current_turn']
+    async with server.match_lock(match['id']):
+        await server.perform_game_action(match, player_id, draw, {})
+    yield match['seq'], copy.deepcopy(game_state)
+    card = server.mask_cards(game_state['players'][player_id]['hand'])[-1]
+    async with server.match_lock(match['id']):
+        await server.perform_game_action(match, player_id, 'discard', {'card_id': server.CARD_IDS[card]})
+    yield match['seq'], copy.deepcopy(game_state)
+
+
+async def test_replay_match_rebuilds_live_state(server, started_match, monkeypatch):
+    monkeypatch.setattr(server, 'MATCH_SNAPSHOT_INTERVAL', 3)
+    match = server.active_games[started_match]
+    states = {match.get('seq', 0): copy.deepcopy(match['game_state'])}
+    for turn in range(12):
+        async for seq, game_state in play_turn(server, match, 'draw_stock' if turn % 3 else 'draw_discard'):
+            states[seq] = game_state
+        if turn % 4 == 3:
+            await server.flush_games()
+    await server.flush_games()
+    assert server.db.match_snapshots.docs, 'expected snapshots between the logged events'
+
+    for seq, game_state in states.items():
+        replayed = await server.replay_match(started_match, seq)
+        assert replayed['seq'] == seq
+        assert comparable(replayed['game_state']) == comparable(game_state)
+
+    latest = await server.replay_match(started_match)
+    assert latest['seq'] == match['seq']
+    assert comparable(latest['game_state']) == comparable(match['game_state'])
+
+
+async def test_load_active_game_recovers_events_past_the_stored_state(server, started_match):
+    match = server.active_games[started_match]
+    await server.flush_games()
+    async for _ in play_turn(server, match, 'draw_stock'):
+        pass
+    live = copy.deepcopy(match)
+    # Crash after the event log write but before the match document caught up
+    await server.flush_match_events()
+    server.active_games.clear()
+    server.dirty_games.clear()
+
+    recovered = await server.load_active_game(started_match)
+    assert recovered['seq'] == live['seq']
+    assert comparable(recovered['game_state']) == comparable(live['game_state'])
+
+
+async def test_lost_join_race_logs_no_deal(server, api, monkeypatch):
+    host_headers, _ = await register(api, 'alice')
+    guest_headers, _ = await register(api, 'bob')
+    match_id = (await api.post('/api/matches', json={'target_points': 50, 'stake_amount': 10},
+                               headers=host_headers)).json()['id']
+    update_one = server.db.matches.update_one
+
+    async def racing_update_one(query, update, **kwargs):
+        # Another writer changes the match between the read and the write
+        monkeypatch.setattr(server.db.matches, 'update_one', update_one)
+        await update_one({'id': match_id}, {'$inc': {'version': 1}})
+        return await update_one(query, update, **kwargs)
+
+    monkeypatch.setattr(server.db.matches, 'update_one', racing_update_one)
+    response = await api.post(f'/api/matches/{match_id}/join', headers=guest_headers)
+    assert response.status_code == 409
+    assert not server.pending_match_events
+
+    response = await api.post(f'/api/matches/{match_id}/join', headers=guest_headers)
+    assert response.status_code == 200, response.text
+    await server.flush_games()
+    replayed = await server.replay_match(match_id, 0)
+    assert comparable(replayed['game_state']) == comparable(server.active_games[match_id]['game_state'])
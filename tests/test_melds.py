@@ -0,0 +1,80 @@
+import random
+from itertools import combinations
+
+import pytest
+
+import server
+
+SUITS = 4
+RANKS = 10
+
+
+def card_points(card):
+    rank = card % RANKS
+    return rank + 1 if rank < 7 else 10
+
+
+def candidate_melds(cards):
+    """Every sequence and set that can be formed from the cards"""
+    melds = []
+    for suit in range(SUITS):
+        for low in range(RANKS):
+            for high in range(low + 3, RANKS + 1):
+                run = {suit * RANKS + rank for rank in range(low, high)}
+                if run <= cards:
+                    melds.append(frozenset(run))
+    for rank in range(RANKS):
+        same_rank = [suit * RANKS + rank for suit in range(SUITS) if suit * RANKS + rank in cards]
+        for size in range(3, len(same_rank) + 1):
+            melds.extend(frozenset(group) for group in combinations(same_rank, size))
+    return melds
+
+
+def brute_force_points(cards):
+    """Fewest unmelded points over every set of disjoint melds"""
+    melds = candidate_melds(cards)
+    best = sum(map(card_points, cards))
+
+    def search(start, left):
+        nonlocal best
+        best = min(best, sum(map(card_points, left)))
+        for index in range(start, len(melds)):
+            if melds[index] <= left:
+                search(index + 1, left - melds[index])
+
+    search(0, frozenset(cards))
+    return best
+
+
+def to_mask(cards):
+    return sum(1 << card for card in cards)
+
+
+def random_hands(count, size, seed):
+    rng = random.Random(seed)
+    return [rng.sample(range(SUITS * RANKS), size) for _ in range(count)]
+
+
+# Hands dense in melds: long runs, four of a kind and runs crossing sets
+EDGE_HANDS = [
+    [],
+    [0, 1, 2, 3, 4, 5, 6],
+    [0, 10, 20, 30, 1, 11, 21],
+    [0, 1, 2, 10, 11, 12, 20, 21],
+    [6, 7, 8, 16, 17, 18, 26, 36],
+    [3, 13, 23, 33, 4, 14, 24, 34],
+    [7, 8, 9, 17, 18, 19, 27, 28, 29, 37],
+]
+
+
+@pytest.mark.parametrize('cards', EDGE_HANDS + random_hands(300, 7, 1) + random_hands(300, 8, 2))
+def test_solve_melds_matches_brute_force(cards):
+    points, melds = server.solve_melds(to_mask(cards))
+    assert points == brute_force_points(set(cards))
+    # The melds returned are valid, disjoint and leave exactly those points
+    covered = 0
+    for meld in melds:
+        assert meld & covered == 0
+        assert meld in server.SEQUENCE_SIZES or meld in server.SET_SIZES
+        covered |= meld
+    assert server.mask_points(to_mask(cards) & ~covered) == points
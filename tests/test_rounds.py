@@ -0,0 +1,38 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+def mask(cards):
+    return sum(1 << card for card in cards)
+
+
+async def test_close_delta_keeps_its_seq_before_the_next_deal(server, started_match, emitted):
+    match = server.active_games[started_match]
+    game_state = match['game_state']
+    closer_id = game_state['current_turn']
+    other_id = next(player_id for player_id in game_state['players'] if player_id != closer_id)
+    # Both hands nearly all melded, so the round closes without ending the match
+    hands = {closer_id: mask([0, 1, 2, 13, 14, 15, 20]), other_id: mask([30, 31, 32, 33, 34, 35, 36])}
+    for player_id, hand in hands.items():
+        game_state['players'][player_id].update(hand=hand, eval=server.evaluate_hand(hand))
+    server.match_player_sids[started_match] = {closer_id: {'closer-sid'}}
+    emitted.clear()
+
+    async with server.match_lock(started_match):
+        await server.perform_game_action(match, closer_id, 'close', {})
+
+    close_event = server.pending_match_events[-2]
+    assert close_event['type'] == 'close'
+    assert server.pending_match_events[-1]['type'] == 'deal'
+    assert match['seq'] == close_event['seq'] + 1
+
+    events = [(event, data) for event, data, room in emitted if room == 'closer-sid']
+    assert [event for event, _ in events] == ['match_delta', 'match_state']
+    delta, state = events[0][1], events[1][1]
+    assert delta['seq'] == close_event['seq']
+    assert delta['round_result']['points'] == {closer_id: 1, other_id: 0}
+    # The delta describes the closed round, the state the new deal
+    assert delta['current_turn'] == closer_id
+    assert state['seq'] == match['seq']
+    assert state['state']['round'] == 2
@@ -0,0 +1,55 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+STAKE = 10
+START_BALANCE = 100.0
+
+
+@pytest.fixture
+async def players(server):
+    for player_id in ('winner', 'loser'):
+        await server.db.users.insert_one({
+            'id': player_id, 'username': player_id, 'balance': START_BALANCE,
+            'stats': {'matches_played': 0, 'wins': 0, 'losses': 0, 'total_won': 0}
+        })
+    return {'id': 'match-1', 'players': ['winner', 'loser'], 'stake_amount': STAKE}
+
+
+async def balances(server):
+    return {user['id']: (user['balance'], user['stats']['matches_played']) for user in server.db.users.docs}
+
+
+async def test_settle_match_is_idempotent(server, players):
+    for _ in range(3):
+        await server.settle_match('match-1', 'winner', match=players)
+
+    payout = STAKE * 2 * 0.95
+    assert await balances(server) == {
+        'winner': (START_BALANCE + payout - STAKE, 1),
+        'loser': (START_BALANCE - STAKE, 1),
+    }
+    assert sorted(entry['type'] for entry in server.db.transactions.docs) == ['commission', 'match_loss', 'match_win']
+
+
+async def test_settle_match_retry_after_failed_balance_write(server, players, monkeypatch):
+    bulk_write = server.db.users.bulk_write
+
+    async def failing_bulk_write(*args, **kwargs):
+        raise RuntimeError('users collection unavailable')
+
+    monkeypatch.setattr(server.db.users, 'bulk_write', failing_bulk_write)
+    with pytest.raises(RuntimeError):
+        await server.settle_match('match-1', 'winner', match=players)
+    # The ledger is written but no balance has moved yet
+    assert len(server.db.transactions.docs) == 3
+    assert await balances(server) == {'winner': (START_BALANCE, 0), 'loser': (START_BALANCE, 0)}
+
+    monkeypatch.setattr(server.db.users, 'bulk_write', bulk_write)
+    await server.settle_match('match-1', 'winner', match=players)
+    await server.settle_match('match-1', 'winner', match=players)
+    assert await balances(server) == {
+        'winner': (START_BALANCE + STAKE * 2 * 0.95 - STAKE, 1),
+        'loser': (START_BALANCE - STAKE, 1),
+    }
+    assert len(server.db.transactions.docs) == 3
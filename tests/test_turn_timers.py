@@ -0,0 +1,53 @@
+import pytest
+
+from server import TimerWheel
+
+
+@pytest.fixture
+def wheel():
+    # 1-second ticks on an 8-slot wheel, so deadlines past 8 seconds wrap
+    return TimerWheel(1.0, 8, now=100.0)
+
+
+def test_expires_keys_once_their_deadline_passes(wheel):
+    wheel.schedule('a', 102.5)
+    wheel.schedule('b', 104.0)
+    assert wheel.advance(102.0) == []
+    assert wheel.advance(103.0) == ['a']
+    assert wheel.advance(103.5) == []
+    assert wheel.advance(104.0) == ['b']
+    assert len(wheel) == 0
+
+
+def test_entries_a_lap_away_wait_for_their_own_tick(wheel):
+    wheel.schedule('near', 103.0)
+    wheel.schedule('far', 103.0 + 8 * 3)
+    assert wheel.advance(103.0) == ['near']
+    assert wheel.advance(111.0) == []
+    assert wheel.advance(126.0) == []
+    assert wheel.advance(127.0) == ['far']
+
+
+def test_reschedule_and_cancel(wheel):
+    wheel.schedule('a', 102.0)
+    wheel.schedule('a', 106.0)
+    wheel.schedule('b', 103.0)
+    wheel.cancel('b')
+    wheel.cancel('missing')
+    assert wheel.advance(105.0) == []
+    assert len(wheel) == 1
+    assert wheel.advance(106.0) == ['a']
+
+
+def test_past_deadlines_expire_on_the_next_tick(wheel):
+    wheel.advance(110.0)
+    wheel.schedule('late', 90.0)
+    assert len(wheel) == 1
+    assert wheel.advance(111.0) == ['late']
+
+
+def test_advancing_over_a_gap_expires_everything_due(wheel):
+    for index in range(20):
+        wheel.schedule(index, 101.0 + index)
+    assert sorted(wheel.advance(1000.0)) == list(range(20))
+    assert len(wheel) == 0
@@ -0,0 +1,146 @@
+import asyncio
+import importlib.util
+import logging
+import socket
+from pathlib import Path
+
+import httpx
+import pytest
+import uvicorn
+
+from in_memory_mongo import InMemoryDatabase
+
+pytestmark = pytest.mark.anyio
+
+SERVER_PATH = Path(__file__).resolve().parent.parent / 'backend' / 'server.py'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def load_worker(worker_id, monkeypatch):
+    """A separate copy of server.py configured as one worker of the cluster"""
+    monkeypatch.setenv('WORKER_ID', str(worker_id))
+    spec = importlib.util.spec_from_file_location(f'server_worker{worker_id}', SERVER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.sio.logger.setLevel(logging.WARNING)
+    return module
+
+
+async def eventually(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, 'condition not reached in time'
+        await asyncio.sleep(0.02)
+
+
+@pytest.fixture
+async def workers(monkeypatch):
+    """Two workers on their own ports sharing a database and a message hub"""
+    ports = [free_port(), free_port()]
+    hub_socket = socket.create_server(('127.0.0.1', 0))
+    monkeypatch.setenv('WORKER_COUNT', '2')
+    monkeypatch.setenv('WORKER_URLS', ','.join(f'http://127.0.0.1:{port}' for port in ports))
+    monkeypatch.setenv('SOCKETIO_MESSAGE_QUEUE', f'tcp://127.0.0.1:{hub_socket.getsockname()[1]}')
+    monkeypatch.setenv('TURN_TIMEOUT_SECONDS', '0')
+    monkeypatch.setenv('BOT_COUNT', '0')
+    modules = [load_worker(worker_id, monkeypatch) for worker_id in (0, 1)]
+    assert all(isinstance(module.sio.manager, module.TcpWorkerManager) for module in modules)
+    hub = asyncio.create_task(modules[0].serve_message_hub(hub_socket))
+
+    database = InMemoryDatabase()
+    servers = []
+    for module, port in zip(modules, ports):
+        module.db = database
+        server = uvicorn.Server(uvicorn.Config(module.socket_app, host='127.0.0.1', port=port, log_level='warning'))
+        servers.append((server, asyncio.create_task(server.serve())))
+    await eventually(lambda: all(server.started for server, _ in servers))
+    yield modules, [f'http://127.0.0.1:{port}' for port in ports]
+
+    for server, _ in servers:
+        server.should_exit = True
+    await asyncio.gather(*(task for _, task in servers))
+    hub.cancel()
+
+
+async def register(api, username):
+    response = await api.post('/api/auth/register', json={'username': username, 'password': 'secret'})
+    token = response.json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    return token, headers, (await api.get('/api/auth/me', headers=headers)).json()
+
+
+async def create_match_owned_by(api, worker, headers, owner):
+    while True:
+        match = (await api.post('/api/matches', json={'target_points': 50, 'stake_amount': 10}, headers=headers)).json()
+        if worker.key_owner(match['id']) == owner:
+            return match
+
+
+async def test_match_requests_are_routed_to_the_owning_worker(workers):
+    (worker0, worker1), urls = workers
+    async with httpx.AsyncClient(base_url=urls[0]) as api:
+        _, host_headers, _ = await register(api, 'alice')
+        _, guest_headers, _ = await register(api, 'bob')
+        match = await create_match_owned_by(api, worker0, host_headers, owner=1)
+        # The open table reaches the other worker's lobby through the hub
+        await eventually(lambda: match['id'] in worker1.lobby_matches)
+
+        response = await api.post(f"/api/matches/{match['id']}/join", headers=guest_headers)
+        assert response.status_code == 200, response.text
+        assert match['id'] in worker1.active_games
+        assert match['id'] not in worker0.active_games
+        await eventually(lambda: match['id'] not in worker0.lobby_matches)
+
+        response = await api.get(f"/api/matches/{match['id']}", headers=host_headers)
+        assert response.status_code == 200
+        assert response.json()['status'] == 'playing'
+
+
+async def test_socket_events_are_forwarded_to_the_owning_worker(workers):
+    socketio = pytest.importorskip('socketio')
+    pytest.importorskip('aiohttp')
+    (worker0, worker1), urls = workers
+    async with httpx.AsyncClient(base_url=urls[0]) as api:
+        host_token, host_headers, host = await register(api, 'alice')
+        guest_token, guest_headers, guest = await register(api, 'bob')
+        match = await create_match_owned_by(api, worker0, host_headers, owner=1)
+        await api.post(f"/api/matches/{match['id']}/join", headers=guest_headers)
+
+    received = {host['id']: [], guest['id']: []}
+    clients = {}
+    for user, token in ((host, host_token), (guest, guest_token)):
+        client = socketio.AsyncClient()
+        client.on('*', lambda event, data, user_id=user['id']: received[user_id].append((event, data)))
+        # Both players connect to the worker that does not own the match
+        await client.connect(urls[0], auth={'token': token}, transports=['websocket'])
+        await client.emit('join_match_room', {'match_id': match['id']})
+        clients[user['id']] = client
+    try:
+        await eventually(lambda: all(any(event == 'match_state' for event, _ in events) for events in received.values()))
+        game_state = worker1.active_games[match['id']]['game_state']
+        await clients[game_state['current_turn']].emit('game_action', {'match_id': match['id'], 'action': 'draw_stock'})
+
+        await eventually(lambda: game_state['phase'] == 'discard')
+        await eventually(lambda: all(any(event == 'match_delta' for event, _ in events) for events in received.values()))
+        assert match['id'] not in worker0.active_games
+    finally:
+        for client in clients.values():
+            await client.disconnect()
+
+
+async def test_matched_game_is_scheduled_on_the_owning_worker(workers, monkeypatch):
+    (worker0, worker1), _ = workers
+    monkeypatch.setattr(worker1, 'TURN_TIMEOUT_SECONDS', 60)
+    # Matchmaking pairs the players on worker 0 while the match hashes to worker 1
+    while True:
+        match = await worker0.start_matched_game(['alice', 'bob'], 50, 10)
+        if worker0.key_owner(match.id) == 1:
+            break
+    await eventually(lambda: match.id in worker1.active_games)
+    assert match.id not in worker0.active_games
+    assert len(worker1.turn_timers) == 1